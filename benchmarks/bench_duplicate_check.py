@@ -0,0 +1,76 @@
+import uuid
+import statistics
+from boto3.dynamodb.conditions import Key
+
+from fast_api_als.database.db_helper import DBHelper
+from benchmarks.fake_dynamodb import ROUND_TRIP_MS, FakeSession, timed
+
+"""
+check_duplicate_lead before and after the batched lookup (user-004).
+A customer with PRIOR_LEADS earlier leads for other models submits a new lead, the worst case
+where every candidate has to be checked. Run with: python -m benchmarks.bench_duplicate_check
+"""
+
+CUSTOMERS = 20
+PRIOR_LEADS = 10
+MAKE = 'Honda'
+
+
+def baseline_check_duplicate_lead(db_helper: DBHelper, email: str, phone: str, last_name: str, make: str,
+                                  model: str):
+    # check_duplicate_lead as it was before user-004: full item queries and one filter status
+    # read plus one query per candidate, one after the other
+    table = db_helper.table
+    email_attached_leads = table.query(IndexName='gsi-index', KeyConditionExpression=Key('gsipk').eq(email))
+    phone_attached_leads = table.query(IndexName='gsi1-index',
+                                       KeyConditionExpression=Key('gsipk1').eq(f"{phone}#{last_name}"))
+    for item in email_attached_leads['Items'] + phone_attached_leads['Items']:
+        metadata = table.get_item(Key={'pk': f"OEM#{make}", 'sk': 'METADATA'})['Item']
+        if metadata.get('settings', {}).get('make_model', "False") == 'True':
+            condition = Key('pk').eq(f"{make}#{item['pk']}") & Key('sk').eq(f"{make}#{model}")
+        else:
+            condition = Key('pk').eq(f"{make}#{item['pk']}")
+        if table.query(KeyConditionExpression=condition)['Items']:
+            return {"Duplicate_Lead": True}
+    return {"Duplicate_Lead": False}
+
+
+def seed(db_helper: DBHelper, make_model: str):
+    table = db_helper.table
+    table.store({'pk': f"OEM#{MAKE}", 'sk': 'METADATA', 'settings': {'make_model': make_model}, 'threshold': '0.5'})
+    customers = []
+    for c in range(CUSTOMERS):
+        email, phone, last_name = f"customer{c}@example.com", f"555000{c:04d}", f"Last{c}"
+        for i in range(PRIOR_LEADS):
+            lead_uuid = str(uuid.uuid4())
+            table.store(db_helper.customer_lead_item(lead_uuid, email, phone, last_name, MAKE, f"Model{i}"))
+            # other make, so the new lead is never a duplicate and every candidate is checked
+            table.store({'pk': f"Acura#{lead_uuid}", 'sk': f"Acura#Model{i}"})
+        customers.append((email, phone, last_name))
+    return customers
+
+
+def run(check, db_helper: DBHelper, customers: list):
+    resource = db_helper.ddb_resource
+    calls_before = resource.calls()
+    durations = []
+    for email, phone, last_name in customers:
+        result, duration = timed(check, email, phone, last_name, MAKE, 'Civic')
+        assert result == {"Duplicate_Lead": False}
+        durations.append(duration * 1000.0)
+    return statistics.mean(durations), (resource.calls() - calls_before) / len(customers)
+
+
+def main():
+    print(f"{CUSTOMERS} customers with {PRIOR_LEADS} earlier leads each, {ROUND_TRIP_MS} ms per round trip")
+    for make_model in ('True', 'False'):
+        db_helper = DBHelper(FakeSession())
+        customers = seed(db_helper, make_model)
+        before = run(lambda *args: baseline_check_duplicate_lead(db_helper, *args), db_helper, customers)
+        after = run(db_helper.check_duplicate_lead, db_helper, customers)
+        print(f"make_model={make_model}: before {before[0]:.1f} ms / {before[1]:.0f} round trips, "
+              f"after {after[0]:.1f} ms / {after[1]:.0f} round trips per check")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import random
+
+from fast_api_als.database import db_helper
+from fast_api_als.services import enrich_lead
+from fast_api_als.utils import zipcode_index
+from fast_api_als.utils.zipcode_index import ZipcodeIndex
+from benchmarks.fake_dynamodb import ROUND_TRIP_MS, FakeSession, timed
+
+"""
+Enriched leads per second before and after the dealer cache and the concurrent lookups (user-023).
+LEADS leads spread over DEALERS dealers, each needing the dealer record and the customer and dealer
+coordinates. The zipcode index is built from generated zipcodes instead of the uszipcode database.
+Run with: python -m benchmarks.bench_enrichment
+"""
+
+LEADS = 500
+DEALERS = 50
+MAKE = 'Honda'
+
+
+def build_leads(helper: db_helper.DBHelper, rng: random.Random) -> list:
+    zipcodes = [f"{zipcode:05d}" for zipcode in rng.sample(range(1000, 99999), 1000)]
+    zipcode_index.zipcode_index = ZipcodeIndex(
+        (zipcode, rng.uniform(25.0, 49.0), rng.uniform(-124.0, -67.0)) for zipcode in zipcodes)
+    dealers = []
+    for i in range(DEALERS):
+        dealer_code, dealer_zip = f"D{i:04d}", rng.choice(zipcodes)
+        helper.dealer_table.store({'pk': dealer_code, 'sk': MAKE, 'dealerCode': dealer_code, 'oem': MAKE,
+                                   'dealerZip': dealer_zip, 'Rating': '4.5', 'Recommended': '90',
+                                   'LifeTimeReviews': '120'})
+        dealers.append((dealer_code, dealer_zip))
+    leads = []
+    for _ in range(LEADS):
+        dealer_code, dealer_zip = rng.choice(dealers)
+        leads.append({'adf': {'prospect': {
+            'vehicle': {'make': MAKE, 'model': 'Civic'},
+            'customer': {'contact': {'address': {'postalcode': rng.choice(zipcodes)}}},
+            'vendor': {'id': {'#text': dealer_code}, 'contact': {'address': {'postalcode': dealer_zip}}}
+        }}})
+    return leads
+
+
+def enrich_one_by_one(helper: db_helper.DBHelper, lead: dict):
+    # the same lookups with no dealer cache, one after the other
+    prospect = lead['adf']['prospect']
+    return {
+        'dealer': helper.load_dealer_data(enrich_lead.get_dealer_code(lead), prospect['vehicle']['make']),
+        'coordinates': enrich_lead.get_coordinates(prospect['customer']['contact']['address']['postalcode']),
+        'dealer_coordinates': enrich_lead.get_coordinates(enrich_lead.get_dealer_postalcode(lead))
+    }
+
+
+def run(enrich, leads: list):
+    def enrich_all():
+        for lead in leads:
+            enriched = enrich(lead)
+            assert enriched is not None
+    _, duration = timed(enrich_all)
+    return duration
+
+
+def main():
+    db_helper.get_boto3_session = FakeSession
+    helper = db_helper.db_helper_session.initialize()
+    leads = build_leads(helper, random.Random(0))
+    print(f"{LEADS} leads over {DEALERS} dealers, {ROUND_TRIP_MS} ms per round trip")
+    for name, enrich in (('before', lambda lead: enrich_one_by_one(helper, lead)),
+                         ('after', enrich_lead.get_enriched_lead_json)):
+        calls_before = helper.ddb_resource.calls()
+        duration = run(enrich, leads)
+        print(f"{name}: {duration * 1000.0:.0f} ms, {helper.ddb_resource.calls() - calls_before} round trips, "
+              f"{LEADS / duration:.0f} enriched leads/s")
+    enrich_lead.close_enrichment_executor()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+import uuid
+from datetime import datetime
+
+from fast_api_als.database.db_helper import DBHelper
+from benchmarks.fake_dynamodb import ROUND_TRIP_MS, FakeSession, timed
+
+"""
+Persisting accepted leads one PutItem at a time versus insert_leads_batch (user-015).
+Every message carries the three items /submit/ writes for an accepted lead.
+Run with: python -m benchmarks.bench_insert_leads
+"""
+
+MESSAGES = 200
+
+
+def build_messages(count: int) -> list:
+    date = datetime.today().strftime('%Y-%m-%d')
+    messages = []
+    for i in range(count):
+        lead_uuid = str(uuid.uuid4())
+        contact = {'email': f"customer{i}@example.com", 'phone': f"555{i:07d}", 'last_name': f"Last{i}"}
+        messages.append({
+            'insert_lead': {'lead_hash': uuid.uuid4().hex, 'service': 'LeadCo', 'response': 'ACCEPTED'},
+            'insert_oem_lead': {
+                'lead_uuid': lead_uuid, 'make': 'Honda', 'model': 'Civic', 'date': date, **contact,
+                'timestamp': f"{date}-10:00:00", 'make_model_filter': False, 'lead_hash': uuid.uuid4().hex,
+                'vendor': 'Best Motors', 'service': 'LeadCo', 'postalcode': '02139'
+            },
+            'insert_customer_lead': {'lead_uuid': lead_uuid, **contact, 'make': 'Honda', 'model': 'Civic'}
+        })
+    return messages
+
+
+def insert_one_by_one(db_helper: DBHelper, messages: list):
+    # how the leads were written before user-015: one PutItem per item
+    for message in messages:
+        lead = message['insert_lead']
+        db_helper.insert_lead(lead['lead_hash'], lead['service'], lead['response'])
+        lead = message['insert_oem_lead']
+        db_helper.insert_oem_lead(lead['lead_uuid'], lead['make'], lead['model'], lead['date'], lead['email'],
+                                  lead['phone'], lead['last_name'], lead['timestamp'], lead['make_model_filter'],
+                                  lead['lead_hash'], lead['vendor'], lead['service'], lead['postalcode'])
+        lead = message['insert_customer_lead']
+        db_helper.insert_customer_lead(lead['lead_uuid'], lead['email'], lead['phone'], lead['last_name'],
+                                       lead['make'], lead['model'])
+    return []
+
+
+def main():
+    messages = build_messages(MESSAGES)
+    print(f"{MESSAGES} accepted leads ({3 * MESSAGES} items), {ROUND_TRIP_MS} ms per round trip")
+    for name, insert in (('before', insert_one_by_one), ('after', DBHelper.insert_leads_batch)):
+        db_helper = DBHelper(FakeSession())
+        failed, duration = timed(insert, db_helper, messages)
+        assert not failed and len(db_helper.table.items) == 3 * MESSAGES
+        print(f"{name}: {duration * 1000.0:.0f} ms, {db_helper.ddb_resource.calls()} round trips, "
+              f"{MESSAGES / duration:.0f} leads/s")
+
+
+if __name__ == '__main__':
+    main()
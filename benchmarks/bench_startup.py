@@ -0,0 +1,41 @@
+import sys
+import importlib
+
+from benchmarks.fake_dynamodb import ROUND_TRIP_MS, FakeSession, timed
+
+"""
+Cold start before and after the lazy DynamoDB initialization (user-021).
+Importing db_helper used to build the DBHelper and run the Initialize_Connection query, now that
+happens on app startup and APP_WARM_UP=false skips the query. The GeoDataManager and the
+dynamodbgeo import, which are also no longer at import time, are left out, the stand-in has no
+DynamoDB client. Run in a fresh interpreter with: python -m benchmarks.bench_startup
+"""
+
+DB_HELPER_MODULE = 'fast_api_als.database.db_helper'
+
+
+def main():
+    if DB_HELPER_MODULE in sys.modules:
+        raise RuntimeError(f"{DB_HELPER_MODULE} is already imported, run the benchmark in a fresh interpreter")
+    db_helper, import_duration = timed(importlib.import_module, DB_HELPER_MODULE)
+
+    # what the import did on top of that before user-021
+    session = FakeSession()
+    helper, init_duration = timed(db_helper.DBHelper, session)
+    _, warm_up_duration = timed(helper.warm_up)
+    before = import_duration + init_duration + warm_up_duration
+    print(f"{ROUND_TRIP_MS} ms per round trip")
+    print(f"before, import: {before * 1000.0:.1f} ms, {session.dynamodb.calls()} round trips")
+    print(f"after, import: {import_duration * 1000.0:.1f} ms, 0 round trips")
+
+    # the same work now runs in the startup hook
+    db_helper.get_boto3_session = FakeSession
+    for warm_up in (True, False):
+        lazy_helper = db_helper.LazyDBHelper()
+        helper, duration = timed(lazy_helper.initialize, warm_up)
+        print(f"after, startup with APP_WARM_UP={str(warm_up).lower()}: {duration * 1000.0:.1f} ms, "
+              f"{helper.ddb_resource.calls()} round trips")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+import time
+import threading
+from collections import defaultdict
+
+"""
+In-memory stand-in for the boto3 DynamoDB resource, for the benchmarks only.
+Every API call sleeps ROUND_TRIP_MS, so the benchmarks measure how many round trips a code path
+makes and how well it overlaps them, not DynamoDB server time. Supports the calls and key
+conditions DBHelper uses on the lead table (primary key, gsi-index, gsi1-index) and on the
+dealer table (dealercode-index).
+"""
+
+ROUND_TRIP_MS = 5.0
+
+# index name -> (partition key, sort key)
+INDEXES = {
+    None: ('pk', 'sk'),
+    'gsi-index': ('gsipk', 'gsisk'),
+    'gsi1-index': ('gsipk1', 'gsisk1'),
+    'dealercode-index': ('dealerCode', 'oem')
+}
+
+OK = {'ResponseMetadata': {'HTTPStatusCode': 200, 'RetryAttempts': 0}}
+
+
+def matches(condition, item) -> bool:
+    expression = condition.get_expression()
+    operator, values = expression['operator'], expression['values']
+    if operator == 'AND':
+        return all(matches(value, item) for value in values)
+    name = values[0].name
+    if operator == '=':
+        return item.get(name) == values[1]
+    if operator == 'begins_with':
+        return str(item.get(name, '')).startswith(values[1])
+    if operator == 'attribute_exists':
+        return name in item
+    raise NotImplementedError(operator)
+
+
+def partition_value(condition, attribute):
+    expression = condition.get_expression()
+    if expression['operator'] == 'AND':
+        for value in expression['values']:
+            found = partition_value(value, attribute)
+            if found is not None:
+                return found
+        return None
+    if expression['operator'] == '=' and expression['values'][0].name == attribute:
+        return expression['values'][1]
+    return None
+
+
+class FakeTable:
+    def __init__(self, name: str, round_trip_ms: float):
+        self.name = name
+        self.round_trip = round_trip_ms / 1000.0
+        self.items = {}
+        self.partitions = {index: defaultdict(dict) for index in INDEXES}
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def round_trip_wait(self):
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.round_trip)
+
+    def store(self, item: dict):
+        key = (item['pk'], item.get('sk'))
+        with self.lock:
+            old = self.items.get(key)
+            if old is not None:
+                for index, (hash_key, _) in INDEXES.items():
+                    if hash_key in old:
+                        self.partitions[index][old[hash_key]].pop(key, None)
+            self.items[key] = dict(item)
+            for index, (hash_key, _) in INDEXES.items():
+                if hash_key in item:
+                    self.partitions[index][item[hash_key]][key] = self.items[key]
+
+    def put_item(self, Item, **kwargs):
+        self.round_trip_wait()
+        self.store(Item)
+        return dict(OK)
+
+    def get_item(self, Key, **kwargs):
+        self.round_trip_wait()
+        item = self.items.get((Key['pk'], Key.get('sk')))
+        res = dict(OK)
+        if item is not None:
+            res['Item'] = dict(item)
+        return res
+
+    def query(self, KeyConditionExpression, IndexName=None, Limit=None, **kwargs):
+        self.round_trip_wait()
+        hash_key = INDEXES[IndexName][0]
+        candidates = self.partitions[IndexName].get(partition_value(KeyConditionExpression, hash_key), {})
+        items = [dict(item) for item in list(candidates.values()) if matches(KeyConditionExpression, item)]
+        if Limit:
+            items = items[:Limit]
+        return {**OK, 'Items': items, 'Count': len(items)}
+
+
+class FakeResource:
+    def __init__(self, round_trip_ms: float = ROUND_TRIP_MS):
+        self.round_trip_ms = round_trip_ms
+        self.tables = {}
+
+    def Table(self, name: str) -> FakeTable:
+        if name not in self.tables:
+            self.tables[name] = FakeTable(name, self.round_trip_ms)
+        return self.tables[name]
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        responses = {}
+        for name, request in RequestItems.items():
+            table = self.Table(name)
+            responses[name] = [dict(table.items[(key['pk'], key.get('sk'))]) for key in request['Keys']
+                               if (key['pk'], key.get('sk')) in table.items]
+        self.Table(next(iter(RequestItems))).round_trip_wait()
+        return {**OK, 'Responses': responses, 'UnprocessedKeys': {}}
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        for name, requests in RequestItems.items():
+            for request in requests:
+                self.Table(name).store(request['PutRequest']['Item'])
+        self.Table(next(iter(RequestItems))).round_trip_wait()
+        return {**OK, 'UnprocessedItems': {}}
+
+    def calls(self) -> int:
+        return sum(table.calls for table in self.tables.values())
+
+
+class FakeSession:
+    def __init__(self, round_trip_ms: float = ROUND_TRIP_MS):
+        self.dynamodb = FakeResource(round_trip_ms)
+
+    def resource(self, service_name: str, **kwargs):
+        return self.dynamodb
+
+    def client(self, service_name: str, **kwargs):
+        raise NotImplementedError(f"{service_name} client is not faked")
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
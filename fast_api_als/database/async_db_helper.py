@@ -0,0 +1,55 @@
+import asyncio
+import functools
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from fast_api_als.database.db_helper import db_helper_session
+
+logger = logging.getLogger(__name__)
+
+"""
+boto3 is synchronous, so the async request handlers must not call DBHelper directly.
+AsyncDBHelper runs DBHelper methods on one executor that lives as long as the app,
+every DBHelper method is available as a coroutine:
+    await async_db_helper_session.fetch_oem_data(make)
+"""
+
+DB_EXECUTOR_WORKERS = 32
+
+
+class AsyncDBHelper:
+    def __init__(self, db_helper, max_workers: int = DB_EXECUTOR_WORKERS):
+        self.db_helper = db_helper
+        self.max_workers = max_workers
+        self.executor = None
+
+    def start(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ddb")
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    async def run(self, func, *args, **kwargs):
+        if self.executor is None:
+            self.start()
+        loop = asyncio.get_running_loop()
+        # carry the request's log context over to the worker thread
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.executor, functools.partial(context.run, func, *args, **kwargs))
+
+    def __getattr__(self, name):
+        attr = getattr(self.db_helper, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def wrapper(*args, **kwargs):
+            return await self.run(attr, *args, **kwargs)
+        return wrapper
+
+
+async_db_helper_session = AsyncDBHelper(db_helper_session)
@@ -1,14 +1,20 @@
+import copy
 import uuid
 import logging
 import time
+import threading
 import boto3
 import botocore
-from boto3.dynamodb.conditions import Key
-import dynamodbgeo
+import botocore.exceptions
+from boto3.dynamodb.conditions import Key, Attr
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from fast_api_als import constants
+from fast_api_als.database.dealer_index import DealerIndex
 from fast_api_als.utils.boto3_utils import get_boto3_session
+from fast_api_als.utils.metrics import metrics_registry
+from fast_api_als.utils.ttl_cache import TTLCache
 """
     the self.table.some_operation(), return a json object and you can find the http code of the executed operation as this :
     res['ResponseMetadata']['HTTPStatusCode']
@@ -16,35 +22,146 @@ from fast_api_als.utils.boto3_utils import get_boto3_session
     write a commong function that logs this response code with appropriate context data
 """
 
+# OEM#<make>/METADATA changes rarely, cache it per worker and invalidate on our own writes
+OEM_CACHE_SIZE = 256
+OEM_CACHE_TTL = 300
+OEM_CACHE_NEGATIVE_TTL = 30
+# api key -> 3PL, unknown keys are cached for a shorter time to absorb floods of bad keys.
+# Rotations invalidate this worker immediately, other workers pick them up after the TTL.
+API_KEY_CACHE_SIZE = 4096
+API_KEY_CACHE_TTL = 60
+API_KEY_CACHE_NEGATIVE_TTL = 10
+# dealer records used by enrichment, keyed by (dealer_code, oem)
+DEALER_CACHE_SIZE = 4096
+DEALER_CACHE_TTL = 15 * 60
+DEALER_CACHE_NEGATIVE_TTL = 60
+# BatchGetItem accepts at most 100 keys per call
+BATCH_GET_LIMIT = 100
+# BatchWriteItem accepts at most 25 items per call
+BATCH_WRITE_LIMIT = 25
+BATCH_RETRY_ATTEMPTS = 5
+BATCH_RETRY_BASE_DELAY = 0.05
+BATCH_STATEMENT_RETRYABLE_ERRORS = {'ThrottlingError', 'ProvisionedThroughputExceeded', 'RequestLimitExceeded',
+                                    'TransactionConflict', 'InternalServerError'}
+LOOKUP_WORKERS = 16
+
+logger = logging.getLogger(__name__)
+
+
+class BatchWriter:
+    """
+            Buffers puts and writes them BATCH_WRITE_LIMIT at a time, flushing on exit.
+            A later put of the same key replaces the buffered one, BatchWriteItem rejects duplicate keys.
+    """
+    def __init__(self, db_helper: 'DBHelper', flush_size: int = BATCH_WRITE_LIMIT):
+        self.db_helper = db_helper
+        self.flush_size = flush_size
+        self.buffer = {}
+        self.failed = []
+
+    def put_item(self, item: dict):
+        self.buffer[(item['pk'], item['sk'])] = item
+        if len(self.buffer) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        items, self.buffer = list(self.buffer.values()), {}
+        self.failed.extend(self.db_helper.batch_put_items(items))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
 
 class DBHelper:
     def __init__(self, session: boto3.session.Session):
         self.session = session
         self.ddb_resource = session.resource('dynamodb', config=botocore.client.Config(max_pool_connections=99))
         self.table = self.ddb_resource.Table(constants.DB_TABLE_NAME)
-        self.geo_data_manager = self.get_geo_data_manager()
+        # only needed when the dealer index is stale, created on first use
+        self.geo_data_manager = None
         self.dealer_table = self.ddb_resource.Table(constants.DEALER_DB_TABLE)
+        self.dealer_index = DealerIndex(self.dealer_table, call=self.call)
+        self.dealer_cache = TTLCache(DEALER_CACHE_SIZE, DEALER_CACHE_TTL, DEALER_CACHE_NEGATIVE_TTL)
+        metrics_registry.register_gauge("dealer_data_cache", self.dealer_cache.stats)
+        self.oem_cache = TTLCache(OEM_CACHE_SIZE, OEM_CACHE_TTL, OEM_CACHE_NEGATIVE_TTL)
+        metrics_registry.register_gauge("oem_metadata_cache", self.oem_cache.stats)
+        self.api_key_cache = TTLCache(API_KEY_CACHE_SIZE, API_KEY_CACHE_TTL, API_KEY_CACHE_NEGATIVE_TTL)
+        metrics_registry.register_gauge("api_key_cache", self.api_key_cache.stats)
+        self.lookup_executor = ThreadPoolExecutor(max_workers=LOOKUP_WORKERS)
+
+    def call(self, operation: str, func, consumed_capacity: bool = True, **kwargs):
+        """
+                Runs one DynamoDB operation and records its latency, HTTP status counts, retries and consumed capacity.
+                Args:
+                    operation: <access pattern>.<api call>, the name the metrics are reported under
+                    func: the boto3 operation, e.g. self.table.query
+                    consumed_capacity: ask DynamoDB for ReturnConsumedCapacity=TOTAL
+                Returns:
+                    the operation's response
+        """
+        if consumed_capacity:
+            kwargs.setdefault('ReturnConsumedCapacity', 'TOTAL')
+        start = time.perf_counter()
+        try:
+            res = func(**kwargs)
+        except botocore.exceptions.ClientError as e:
+            metrics_registry.observe(f"dynamodb.{operation}", (time.perf_counter() - start) * 1000.0)
+            metrics_registry.increment(f"dynamodb.{operation}.errors")
+            metadata = e.response.get('ResponseMetadata', {})
+            metrics_registry.increment(f"dynamodb.{operation}.retries", metadata.get('RetryAttempts', 0))
+            metrics_registry.increment(f"dynamodb.{operation}.status.{metadata.get('HTTPStatusCode', 'unknown')}")
+            verify_response(metadata.get('HTTPStatusCode'), operation,
+                            error_code=e.response.get('Error', {}).get('Code'))
+            raise
+        metrics_registry.observe(f"dynamodb.{operation}", (time.perf_counter() - start) * 1000.0)
+        metrics_registry.increment(f"dynamodb.{operation}.calls")
+        if isinstance(res, dict) and 'ResponseMetadata' in res:
+            metadata = res['ResponseMetadata']
+            metrics_registry.increment(f"dynamodb.{operation}.retries", metadata.get('RetryAttempts', 0))
+            metrics_registry.increment(f"dynamodb.{operation}.capacity_units",
+                                       consumed_capacity_units(res.get('ConsumedCapacity')))
+            metrics_registry.increment(f"dynamodb.{operation}.status.{metadata.get('HTTPStatusCode', 'unknown')}")
+            verify_response(metadata.get('HTTPStatusCode'), operation)
+        return res
+
+    def warm_up(self):
+        # opens the connection pool before the first request needs it
         self.get_api_key_author("Initialize_Connection")
 
     def get_geo_data_manager(self):
+        import dynamodbgeo
         config = dynamodbgeo.GeoDataManagerConfiguration(self.session.client('dynamodb', config=botocore.client.Config(max_pool_connections=99)), constants.DEALER_DB_TABLE)
         geo_data_manager = dynamodbgeo.GeoDataManager(config)
         return geo_data_manager
 
     def insert_lead(self, lead_hash: str, lead_provider: str, response: str):
-        item = {
+        item = self.lead_item(lead_hash, lead_provider, response)
+        res = self.call("insert_lead.put_item", self.table.put_item, Item=item)
+
+    def lead_item(self, lead_hash: str, lead_provider: str, response: str):
+        return {
             'pk': f'LEAD#{lead_hash}',
             'sk': lead_provider,
             'response': response,
             'ttl': datetime.fromtimestamp(int(time.time())) + timedelta(days=constants.LEAD_ITEM_TTL)
         }
-        res = self.table.put_item(Item=item)
 
     def insert_oem_lead(self, uuid: str, make: str, model: str, date: str, email: str, phone: str, last_name: str,
                         timestamp: str, make_model_filter_status: str, lead_hash: str, dealer: str, provider: str,
                         postalcode: str):
+        item = self.oem_lead_item(uuid, make, model, date, email, phone, last_name, timestamp,
+                                  make_model_filter_status, lead_hash, dealer, provider, postalcode)
+        res = self.call("insert_oem_lead.put_item", self.table.put_item, Item=item)
 
-        item = {
+    def oem_lead_item(self, uuid: str, make: str, model: str, date: str, email: str, phone: str, last_name: str,
+                      timestamp: str, make_model_filter_status: str, lead_hash: str, dealer: str, provider: str,
+                      postalcode: str):
+        return {
             'pk': f"{make}#{uuid}",
             'sk': f"{make}#{model}",
             'gsipk': f"{make}#{date}",
@@ -64,76 +181,155 @@ class DBHelper:
             'ttl': datetime.fromtimestamp(int(time.time())) + timedelta(days=constants.OEM_ITEM_TTL)
         }
 
-        res = self.table.put_item(Item=item)
-
     def check_duplicate_api_call(self, lead_hash: str, lead_provider: str):
-        res = self.table.get_item(
+        res = self.call("check_duplicate_api_call.get_item", self.table.get_item,
             Key={
                 'pk': f"LEAD#{lead_hash}",
                 'sk': lead_provider
             }
         )
-        item = res.get('Item')
-        if not item:
-            return {
-                "Duplicate_Api_Call": {
-                    "status": False,
-                    "response": "No_Duplicate_Api_Call"
-                }
-            }
-        else:
-            return {
-                "Duplicate_Api_Call": {
-                    "status": True,
-                    "response": item['response']
+        return duplicate_api_call_result(res.get('Item'))
+
+    def check_duplicate_api_calls(self, leads: list):
+        """
+                check_duplicate_api_call for many leads with BatchGetItem.
+                Args:
+                    leads: (lead_hash, lead_provider) pairs
+                Returns:
+                    {(lead_hash, lead_provider): check_duplicate_api_call result}
+        """
+        leads = list(dict.fromkeys(leads))
+        items = {}
+        for i in range(0, len(leads), BATCH_GET_LIMIT):
+            request = {
+                constants.DB_TABLE_NAME: {
+                    'Keys': [{'pk': f"LEAD#{lead_hash}", 'sk': lead_provider}
+                             for lead_hash, lead_provider in leads[i:i + BATCH_GET_LIMIT]],
+                    'ProjectionExpression': 'pk, sk, #response',
+                    'ExpressionAttributeNames': {'#response': 'response'}
                 }
             }
+            for attempt in range(BATCH_RETRY_ATTEMPTS):
+                res = self.call("check_duplicate_api_calls.batch_get_item", self.ddb_resource.batch_get_item,
+                                RequestItems=request)
+                for item in res.get('Responses', {}).get(constants.DB_TABLE_NAME, []):
+                    items[(item['pk'][len('LEAD#'):], item['sk'])] = item
+                request = res.get('UnprocessedKeys')
+                if not request:
+                    break
+                time.sleep(BATCH_RETRY_BASE_DELAY * (2 ** attempt))
+            else:
+                raise RuntimeError(f"BatchGetItem left {len(request[constants.DB_TABLE_NAME]['Keys'])} "
+                                   f"keys unprocessed after {BATCH_RETRY_ATTEMPTS} attempts")
+        return {lead: duplicate_api_call_result(items.get(lead)) for lead in leads}
 
     def accepted_lead_not_sent_for_oem(self, oem: str, date: str):
-        res = self.table.query(
-            IndexName='gsi-index',
-            KeyConditionExpression=Key('gsipk').eq(f"{oem}#{date}")
-                                   & Key('gsisk').begins_with("0#0")
-        )
-
-        return res.get('Items', [])
+        return list(self.iter_accepted_leads_not_sent_for_oem(oem, date))
+
+    def iter_accepted_leads_not_sent_for_oem(self, oem: str, date: str):
+        for page in self.accepted_lead_pages_not_sent_for_oem(oem, date):
+            yield from page
+
+    def accepted_lead_pages_not_sent_for_oem(self, oem: str, date: str, page_size: int = None):
+        """
+                Yields the unsent accepted leads of an OEM for a day one query page at a time,
+                only one page is held in memory.
+        """
+        kwargs = {
+            'IndexName': 'gsi-index',
+            'KeyConditionExpression': Key('gsipk').eq(f"{oem}#{date}") & Key('gsisk').begins_with("0#0")
+        }
+        if page_size:
+            kwargs['Limit'] = page_size
+        while True:
+            res = self.call("accepted_lead_pages_not_sent_for_oem.query", self.table.query, **kwargs)
+            yield res.get('Items', [])
+            if 'LastEvaluatedKey' not in res:
+                return
+            kwargs['ExclusiveStartKey'] = res['LastEvaluatedKey']
+
+    def mark_leads_sent(self, keys: list):
+        """
+                Marks leads as sent with conditional PartiQL updates, BATCH_WRITE_LIMIT per BatchExecuteStatement.
+                Only gsisk changes and only while the lead is still unsent, a conversion recorded in the
+                meantime is kept.
+                Args:
+                    keys: (pk, sk) of the leads
+                Returns:
+                    (number marked, number no longer unsent, keys that could not be written)
+        """
+        statement = f"UPDATE \"{constants.DB_TABLE_NAME}\" SET gsisk = '1#0' WHERE pk = ? AND sk = ? AND gsisk = '0#0'"
+        keys = list(dict.fromkeys(keys))
+        marked, skipped, failed = 0, 0, []
+        for i in range(0, len(keys), BATCH_WRITE_LIMIT):
+            pending = keys[i:i + BATCH_WRITE_LIMIT]
+            for attempt in range(BATCH_RETRY_ATTEMPTS):
+                if attempt:
+                    time.sleep(BATCH_RETRY_BASE_DELAY * (2 ** (attempt - 1)))
+                res = self.call("mark_leads_sent.batch_execute_statement",
+                                self.ddb_resource.meta.client.batch_execute_statement,
+                                Statements=[{'Statement': statement, 'Parameters': [{'S': pk}, {'S': sk}]}
+                                            for pk, sk in pending])
+                retry = []
+                for key, response in zip(pending, res['Responses']):
+                    code = response.get('Error', {}).get('Code')
+                    if code is None:
+                        marked += 1
+                    elif code == 'ConditionalCheckFailed':
+                        skipped += 1
+                    elif code in BATCH_STATEMENT_RETRYABLE_ERRORS:
+                        retry.append(key)
+                    else:
+                        logger.error(f"Marking lead {key[0]} as sent failed: {code} {response['Error'].get('Message')}")
+                        failed.append(key)
+                pending = retry
+                if not pending:
+                    break
+            failed.extend(pending)
+        return marked, skipped, failed
 
     def update_lead_sent_status(self, uuid: str, oem: str, make: str, model: str):
-        res = self.table.get_item(
-            Key={
-                'pk': f"{uuid}#{oem}"
-            }
-        )
-        item = res['Item']
-        if not item:
-            return False
-        item['gsisk'] = "1#0"
-        res = self.table.put_item(Item=item)
+        try:
+            res = self.call("update_lead_sent_status.update_item", self.table.update_item,
+                Key={
+                    'pk': f"{oem}#{uuid}",
+                    'sk': f"{make}#{model}"
+                },
+                UpdateExpression='SET gsisk = :gsisk',
+                ConditionExpression=Attr('pk').exists(),
+                ExpressionAttributeValues={':gsisk': "1#0"}
+            )
+        except botocore.exceptions.ClientError as e:
+            if is_conditional_check_failed(e):
+                return False
+            raise
         return True
 
     def get_make_model_filter_status(self, oem: str):
-        res = self.table.get_item(
-            Key={
-                'pk': f"OEM#{oem}",
-                'sk': 'METADATA'
-            }
-        )
-        if res['Item'].get('settings', {}).get('make_model', "False") == 'True':
+        item = self.get_oem_metadata(oem)
+        if item.get('settings', {}).get('make_model', "False") == 'True':
             return True
         return False
 
     def verify_api_key(self, apikey: str):
-        res = self.table.query(
+        return self.get_api_key_provider(apikey) is not None
+
+    def get_api_key_provider(self, apikey: str):
+        return self.api_key_cache.get_or_load(apikey, lambda: self.load_api_key_provider(apikey),
+                                              is_negative=lambda provider: provider is None)
+
+    def load_api_key_provider(self, apikey: str):
+        res = self.call("load_api_key_provider.query", self.table.query,
             IndexName='gsi-index',
             KeyConditionExpression=Key('gsipk').eq(apikey)
         )
         item = res.get('Items', [])
         if len(item) == 0:
-            return False
-        return True
+            return None
+        return item[0].get("pk", "unknown")
 
     def get_auth_key(self, username: str):
-        res = self.table.query(
+        res = self.call("get_auth_key.query", self.table.query,
             KeyConditionExpression=Key('pk').eq(username)
         )
         item = res['Items']
@@ -144,17 +340,18 @@ class DBHelper:
     def set_auth_key(self, username: str):
         self.delete_3PL(username)
         apikey = str(uuid.uuid4())
-        res = self.table.put_item(
+        res = self.call("set_auth_key.put_item", self.table.put_item,
             Item={
                 'pk': username,
                 'sk': apikey,
                 'gsipk': apikey
             }
         )
+        self.api_key_cache.invalidate(apikey)
         return apikey
 
     def register_3PL(self, username: str):
-        res = self.table.query(
+        res = self.call("register_3PL.query", self.table.query,
             KeyConditionExpression=Key('pk').eq(username)
         )
         item = res.get('Items', [])
@@ -163,28 +360,51 @@ class DBHelper:
         return self.set_auth_key(username)
 
     def set_make_model_oem(self, oem: str, make_model: str):
-        item = self.fetch_oem_data(oem)
-        item['settings']['make_model'] = make_model
-        res = self.table.put_item(Item=item)
-
-    def fetch_oem_data(self, oem, parallel=False):
-        res = self.table.get_item(
+        try:
+            res = self.call("set_make_model_oem.update_item", self.table.update_item,
+                Key={
+                    'pk': f"OEM#{oem}",
+                    'sk': "METADATA"
+                },
+                UpdateExpression='SET #settings.make_model = :make_model',
+                ConditionExpression=Attr('pk').exists(),
+                ExpressionAttributeNames={'#settings': 'settings'},
+                ExpressionAttributeValues={':make_model': make_model}
+            )
+        except botocore.exceptions.ClientError as e:
+            if not is_conditional_check_failed(e):
+                raise
+            logger.warning(f"OEM {oem} not found, make_model not set")
+        self.oem_cache.invalidate(oem)
+
+    def get_oem_metadata(self, oem: str):
+        # returns the cached item itself, callers must not mutate it
+        return self.oem_cache.get_or_load(oem, lambda: self.load_oem_metadata(oem),
+                                          is_negative=lambda item: item == {})
+
+    def load_oem_metadata(self, oem: str):
+        res = self.call("load_oem_metadata.get_item", self.table.get_item,
             Key={
                 'pk': f"OEM#{oem}",
                 'sk': "METADATA"
             }
         )
-        if 'Item' not in res:
+        return res.get('Item', {})
+
+    def fetch_oem_data(self, oem, parallel=False):
+        item = self.get_oem_metadata(oem)
+        if item == {}:
             return {}
+        item = copy.deepcopy(item)
         if parallel:
             return {
-                "fetch_oem_data": res['Item']
+                "fetch_oem_data": item
             }
         else:
-            return res['Item']
+            return item
 
     def create_new_oem(self, oem: str, make_model: str, threshold: str):
-        res = self.table.put_item(
+        res = self.call("create_new_oem.put_item", self.table.put_item,
             Item={
                 'pk': f"OEM#{oem}",
                 'sk': "METADATA",
@@ -194,52 +414,73 @@ class DBHelper:
                 'threshold': threshold
             }
         )
+        self.oem_cache.invalidate(oem)
 
     def delete_oem(self, oem: str):
-        res = self.table.delete_item(
+        res = self.call("delete_oem.delete_item", self.table.delete_item,
             Key={
                 'pk': f"OEM#{oem}",
                 'sk': "METADATA"
             }
         )
+        self.oem_cache.invalidate(oem)
 
     def delete_3PL(self, username: str):
         authkey = self.get_auth_key(username)
         if authkey:
-            res = self.table.delete_item(
+            res = self.call("delete_3PL.delete_item", self.table.delete_item,
                 Key={
                     'pk': username,
                     'sk': authkey
                 }
             )
+            self.api_key_cache.invalidate(authkey)
 
     def set_oem_threshold(self, oem: str, threshold: str):
-        item = self.fetch_oem_data(oem)
-        if item == {}:
+        try:
+            res = self.call("set_oem_threshold.update_item", self.table.update_item,
+                Key={
+                    'pk': f"OEM#{oem}",
+                    'sk': "METADATA"
+                },
+                UpdateExpression='SET #threshold = :threshold',
+                ConditionExpression=Attr('pk').exists(),
+                ExpressionAttributeNames={'#threshold': 'threshold'},
+                ExpressionAttributeValues={':threshold': threshold}
+            )
+        except botocore.exceptions.ClientError as e:
+            if not is_conditional_check_failed(e):
+                raise
             return {
                 "error": f"OEM {oem} not found"
             }
-        item['threshold'] = threshold
-        res = self.table.put_item(Item=item)
+        self.oem_cache.invalidate(oem)
         return {
             "success": f"OEM {oem} threshold set to {threshold}"
         }
 
     def fetch_nearest_dealer(self, oem: str, lat: str, lon: str):
+        dealer = self.dealer_index.nearest(oem, float(lat), float(lon), 50000)
+        if dealer is not None:
+            return dealer
+        # index not loaded yet or stale, ask DynamoDB
         query_input = {
             "FilterExpression": "oem = :val1",
             "ExpressionAttributeValues": {
                 ":val1": {"S": oem},
             }
         }
-        res = self.geo_data_manager.queryRadius(
-            dynamodbgeo.QueryRadiusRequest(
-                dynamodbgeo.GeoPoint(lat, lon),
-                50000,  # radius = 50km
-                query_input,
-                sort=True
-            )
-        )
+        import dynamodbgeo
+        if self.geo_data_manager is None:
+            self.geo_data_manager = self.get_geo_data_manager()
+        res = self.call("fetch_nearest_dealer.query_radius", self.geo_data_manager.queryRadius,
+                        consumed_capacity=False,
+                        QueryRadiusInput=dynamodbgeo.QueryRadiusRequest(
+                            dynamodbgeo.GeoPoint(lat, lon),
+                            50000,  # radius = 50km
+                            query_input,
+                            sort=True
+                        ))
         if len(res) == 0:
             return {}
         res = res[0]
@@ -259,7 +500,12 @@ class DBHelper:
     def get_dealer_data(self, dealer_code: str, oem: str):
         if not dealer_code:
             return {}
-        res = self.dealer_table.query(
+        dealer = self.dealer_cache.get_or_load((dealer_code, oem), lambda: self.load_dealer_data(dealer_code, oem),
+                                               is_negative=lambda dealer: dealer == {})
+        return dict(dealer)
+
+    def load_dealer_data(self, dealer_code: str, oem: str):
+        res = self.call("load_dealer_data.query", self.dealer_table.query,
             IndexName='dealercode-index',
             KeyConditionExpression=Key('dealerCode').eq(dealer_code) & Key('oem').eq(oem)
         )
@@ -275,7 +521,11 @@ class DBHelper:
         }
 
     def insert_customer_lead(self, uuid: str, email: str, phone: str, last_name: str, make: str, model: str):
-        item = {
+        item = self.customer_lead_item(uuid, email, phone, last_name, make, model)
+        res = self.call("insert_customer_lead.put_item", self.table.put_item, Item=item)
+
+    def customer_lead_item(self, uuid: str, email: str, phone: str, last_name: str, make: str, model: str):
+        return {
             'pk': uuid,
             'sk': 'CUSTOMER_LEAD',
             'gsipk': email,
@@ -287,18 +537,64 @@ class DBHelper:
             'model': model,
             'ttl': datetime.fromtimestamp(int(time.time())) + timedelta(days=constants.OEM_ITEM_TTL)
         }
-        res = self.table.put_item(Item=item)
+
+    def batch_writer(self):
+        return BatchWriter(self)
+
+    def batch_put_items(self, items: list):
+        """
+                Writes items with BatchWriteItem, retrying unprocessed items with exponential backoff.
+                Args:
+                    items: at most BATCH_WRITE_LIMIT items with distinct keys
+                Returns:
+                    items that are still unprocessed after BATCH_RETRY_ATTEMPTS
+        """
+        request = {constants.DB_TABLE_NAME: [{'PutRequest': {'Item': item}} for item in items]}
+        for attempt in range(BATCH_RETRY_ATTEMPTS):
+            res = self.call("batch_put_items.batch_write_item", self.ddb_resource.batch_write_item,
+                            RequestItems=request)
+            request = res.get('UnprocessedItems')
+            if not request:
+                return []
+            time.sleep(BATCH_RETRY_BASE_DELAY * (2 ** attempt))
+        unprocessed = [entry['PutRequest']['Item'] for entry in request.get(constants.DB_TABLE_NAME, [])]
+        logger.error(f"{len(unprocessed)} items left unprocessed after {BATCH_RETRY_ATTEMPTS} batch write attempts")
+        return unprocessed
+
+    def insert_leads_batch(self, messages: list):
+        """
+                Persists the leads of many queue messages (as built by /submit/) with batched writes.
+                Returns:
+                    items that could not be written
+        """
+        with self.batch_writer() as writer:
+            for message in messages:
+                if 'insert_lead' in message:
+                    lead = message['insert_lead']
+                    writer.put_item(self.lead_item(lead['lead_hash'], lead['service'], lead['response']))
+                if 'insert_oem_lead' in message:
+                    lead = message['insert_oem_lead']
+                    writer.put_item(self.oem_lead_item(lead['lead_uuid'], lead['make'], lead['model'], lead['date'],
+                                                       lead['email'], lead['phone'], lead['last_name'],
+                                                       lead['timestamp'], lead['make_model_filter'],
+                                                       lead['lead_hash'], lead['vendor'], lead['service'],
+                                                       lead['postalcode']))
+                if 'insert_customer_lead' in message:
+                    lead = message['insert_customer_lead']
+                    writer.put_item(self.customer_lead_item(lead['lead_uuid'], lead['email'], lead['phone'],
+                                                            lead['last_name'], lead['make'], lead['model']))
+        return writer.failed
 
     def lead_exists(self, uuid: str, make: str, model: str):
         lead_exist = False
         if self.get_make_model_filter_status(make):
-            res = self.table.query(
+            res = self.call("lead_exists.query", self.table.query,
                 KeyConditionExpression=Key('pk').eq(f"{make}#{uuid}") & Key('sk').eq(f"{make}#{model}")
             )
             if len(res['Items']):
                 lead_exist = True
         else:
-            res = self.table.query(
+            res = self.call("lead_exists.query", self.table.query,
                 KeyConditionExpression=Key('pk').eq(f"{make}#{uuid}")
             )
             if len(res['Items']):
@@ -306,52 +602,178 @@ class DBHelper:
         return lead_exist
 
     def check_duplicate_lead(self, email: str, phone: str, last_name: str, make: str, model: str):
-        email_attached_leads = self.table.query(
+        email_attached_leads = self.call("check_duplicate_lead.email_query", self.table.query,
             IndexName='gsi-index',
-            KeyConditionExpression=Key('gsipk').eq(email)
+            KeyConditionExpression=Key('gsipk').eq(email),
+            ProjectionExpression='pk'
         )
-        phone_attached_leads = self.table.query(
+        phone_attached_leads = self.call("check_duplicate_lead.phone_query", self.table.query,
             IndexName='gsi1-index',
-            KeyConditionExpression=Key('gsipk1').eq(f"{phone}#{last_name}")
+            KeyConditionExpression=Key('gsipk1').eq(f"{phone}#{last_name}"),
+            ProjectionExpression='pk'
         )
         customer_leads = email_attached_leads['Items'] + phone_attached_leads['Items']
+        # the same customer lead is usually found through both email and phone
+        lead_uuids = list(dict.fromkeys(item['pk'] for item in customer_leads))
+        if not lead_uuids:
+            return {"Duplicate_Lead": False}
 
-        for item in customer_leads:
-            if self.lead_exists(item['pk'], make, model):
-                return {"Duplicate_Lead": True}
-        return {"Duplicate_Lead": False}
+        # one filter status lookup for all candidates instead of one per lead
+        if self.get_make_model_filter_status(make):
+            duplicate = self.any_oem_lead_exists(lead_uuids, make, model)
+        else:
+            duplicate = self.any_oem_lead_exists_for_make(lead_uuids, make)
+        return {"Duplicate_Lead": duplicate}
+
+    def any_oem_lead_exists(self, lead_uuids: list, make: str, model: str):
+        # full primary keys are known, so fetch them with BatchGetItem and stop at the first hit
+        keys = [{'pk': f"{make}#{lead_uuid}", 'sk': f"{make}#{model}"} for lead_uuid in lead_uuids]
+        for i in range(0, len(keys), BATCH_GET_LIMIT):
+            request = {
+                constants.DB_TABLE_NAME: {
+                    'Keys': keys[i:i + BATCH_GET_LIMIT],
+                    'ProjectionExpression': 'pk'
+                }
+            }
+            for attempt in range(BATCH_RETRY_ATTEMPTS):
+                res = self.call("any_oem_lead_exists.batch_get_item", self.ddb_resource.batch_get_item,
+                                RequestItems=request)
+                if res.get('Responses', {}).get(constants.DB_TABLE_NAME):
+                    return True
+                request = res.get('UnprocessedKeys')
+                if not request:
+                    break
+                time.sleep(BATCH_RETRY_BASE_DELAY * (2 ** attempt))
+            else:
+                # keys DynamoDB never read are not evidence that the lead is new
+                raise RuntimeError(f"BatchGetItem left {len(request[constants.DB_TABLE_NAME]['Keys'])} "
+                                   f"keys unprocessed after {BATCH_RETRY_ATTEMPTS} attempts")
+        return False
 
-    def get_api_key_author(self, apikey):
-        res = self.table.query(
-            IndexName='gsi-index',
-            KeyConditionExpression=Key('gsipk').eq(apikey)
+    def any_oem_lead_exists_for_make(self, lead_uuids: list, make: str):
+        # only the partition key is known, query the candidates in parallel and stop at the first hit
+        futures = [self.lookup_executor.submit(self.oem_lead_exists_for_make, lead_uuid, make)
+                   for lead_uuid in lead_uuids]
+        try:
+            for future in as_completed(futures):
+                if future.result():
+                    return True
+            return False
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def oem_lead_exists_for_make(self, lead_uuid: str, make: str):
+        res = self.call("oem_lead_exists_for_make.query", self.table.query,
+            KeyConditionExpression=Key('pk').eq(f"{make}#{lead_uuid}"),
+            ProjectionExpression='pk',
+            Limit=1
         )
-        item = res.get('Items', [])
-        if len(item) == 0:
+        return len(res['Items']) > 0
+
+    def get_api_key_author(self, apikey):
+        provider = self.get_api_key_provider(apikey)
+        if provider is None:
             return "unknown"
-        return item[0].get("pk", "unknown")
+        return provider
 
     def update_lead_conversion(self, lead_uuid: str, oem: str, converted: int):
-        res = self.table.query(
-            KeyConditionExpression=Key('pk').eq(f"{oem}#{lead_uuid}")
+        # the callback does not carry the model, so the sort key has to be looked up first
+        res = self.call("update_lead_conversion.query", self.table.query,
+            KeyConditionExpression=Key('pk').eq(f"{oem}#{lead_uuid}"),
+            ProjectionExpression='pk, sk',
+            Limit=1
         )
         items = res.get('Items')
         if len(items) == 0:
             return False, {}
-        item = items[0]
-        item['oem_responded'] = 1
-        item['conversion'] = converted
-        item['gsisk'] = f"1#{converted}"
-        res = self.table.put_item(Item=item)
-        return True, item
+        try:
+            res = self.call("update_lead_conversion.update_item", self.table.update_item,
+                Key={
+                    'pk': items[0]['pk'],
+                    'sk': items[0]['sk']
+                },
+                UpdateExpression='SET #oem_responded = :oem_responded, #conversion = :conversion, gsisk = :gsisk',
+                ConditionExpression=Attr('pk').exists(),
+                ExpressionAttributeNames={'#oem_responded': 'oem_responded', '#conversion': 'conversion'},
+                ExpressionAttributeValues={
+                    ':oem_responded': 1,
+                    ':conversion': converted,
+                    ':gsisk': f"1#{converted}"
+                },
+                ReturnValues='ALL_NEW'
+            )
+        except botocore.exceptions.ClientError as e:
+            if is_conditional_check_failed(e):
+                return False, {}
+            raise
+        return True, res['Attributes']
 
 
-def verify_response(response_code):
-    if not response_code == 200:
-        pass
-    else:
-        pass
+def duplicate_api_call_result(item) -> dict:
+    if not item:
+        return {
+            "Duplicate_Api_Call": {
+                "status": False,
+                "response": "No_Duplicate_Api_Call"
+            }
+        }
+    return {
+        "Duplicate_Api_Call": {
+            "status": True,
+            "response": item['response']
+        }
+    }
+
+
+def consumed_capacity_units(consumed_capacity) -> float:
+    # single table operations return a dict, batch operations a list with one entry per table
+    if not consumed_capacity:
+        return 0.0
+    if isinstance(consumed_capacity, dict):
+        consumed_capacity = [consumed_capacity]
+    return float(sum(entry.get('CapacityUnits', 0) for entry in consumed_capacity))
 
 
-session = get_boto3_session()
-db_helper_session = DBHelper(session)
+def is_conditional_check_failed(error: botocore.exceptions.ClientError) -> bool:
+    return error.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException'
+
+
+def verify_response(response_code, operation: str = '', **context):
+    if not response_code == 200:
+        logger.error(f"DynamoDB {operation} returned {response_code}", extra={
+            "operation": operation,
+            "status_code": response_code,
+            **context
+        })
+    else:
+        logger.debug(f"DynamoDB {operation} returned {response_code}", extra={
+            "operation": operation,
+            "status_code": response_code,
+            **context
+        })
+
+
+class LazyDBHelper:
+    """
+            Stands in for the DBHelper until it is first used, so importing this module does not
+            create boto3 clients or touch the network. main.py initializes it on startup.
+    """
+    def __init__(self):
+        self.instance = None
+        self.lock = threading.Lock()
+
+    def initialize(self, warm_up: bool = False) -> DBHelper:
+        if self.instance is None:
+            with self.lock:
+                if self.instance is None:
+                    self.instance = DBHelper(get_boto3_session())
+        if warm_up:
+            self.instance.warm_up()
+        return self.instance
+
+    def __getattr__(self, name):
+        return getattr(self.initialize(), name)
+
+
+db_helper_session = LazyDBHelper()
@@ -0,0 +1,125 @@
+import math
+import time
+import logging
+import threading
+from collections import defaultdict
+
+from fast_api_als.utils.geo import EARTH_RADIUS_METERS, haversine_meters
+
+logger = logging.getLogger(__name__)
+
+"""
+Per-OEM in-memory index of the dealer table for nearest-dealer lookups.
+Dealers are bucketed in a 1 degree lat/lon grid, a lookup only checks the cells the search radius
+touches. Distances come from utils.geo, so the answer matches the DynamoDB path. While the index is not loaded or older than max_age,
+nearest() returns None and the caller falls back to DynamoDB.
+"""
+
+DEALER_INDEX_REFRESH_INTERVAL = 15 * 60
+DEALER_INDEX_MAX_AGE = 2 * DEALER_INDEX_REFRESH_INTERVAL
+
+
+def vendor_from_dealer(dealer):
+    return {
+        'id': {
+            '#text': dealer['dealerCode']
+        },
+        'vendorname': dealer['dealerName'],
+        'contact': {
+            'address': {
+                'postalcode': dealer['dealerZip']
+            }
+        }
+    }
+
+
+class DealerIndex:
+    def __init__(self, dealer_table, max_age: float = DEALER_INDEX_MAX_AGE, call=None):
+        self.dealer_table = dealer_table
+        # DBHelper.call, to get the scans into the DynamoDB metrics
+        self.call = call
+        self.max_age = max_age
+        # oem -> (lat cell, lon cell) -> [(lat, lon, dealer)]
+        self.grid = {}
+        self.loaded_at = None
+        self.stop_event = threading.Event()
+        self.refresher = None
+
+    def is_stale(self) -> bool:
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > self.max_age
+
+    def scan_dealers(self):
+        kwargs = {
+            'ProjectionExpression': '#oem, dealerCode, dealerName, dealerZip, geoJson',
+            'ExpressionAttributeNames': {'#oem': 'oem'}
+        }
+        while True:
+            if self.call is not None:
+                res = self.call("dealer_index.scan", self.dealer_table.scan, **kwargs)
+            else:
+                res = self.dealer_table.scan(**kwargs)
+            yield from res.get('Items', [])
+            if 'LastEvaluatedKey' not in res:
+                return
+            kwargs['ExclusiveStartKey'] = res['LastEvaluatedKey']
+
+    def refresh(self):
+        grid = defaultdict(lambda: defaultdict(list))
+        count = 0
+        for dealer in self.scan_dealers():
+            try:
+                lat, lon = (float(value) for value in dealer['geoJson'].split(','))
+                row = (lat, lon, {key: dealer[key] for key in ('dealerCode', 'dealerName', 'dealerZip')})
+                grid[dealer['oem']][(math.floor(lat), math.floor(lon))].append(row)
+                count += 1
+            except (KeyError, ValueError) as e:
+                logger.warning(f"Skipping dealer {dealer.get('dealerCode')} in dealer index: {e}")
+        # swap in the new grid in one assignment, readers never see a partial index
+        self.grid = {oem: dict(cells) for oem, cells in grid.items()}
+        self.loaded_at = time.monotonic()
+        logger.info(f"Dealer index loaded {count} dealers for {len(self.grid)} OEMs")
+
+    def nearest(self, oem: str, lat: float, lon: float, radius: float):
+        """
+                Returns:
+                    vendor dict of the nearest dealer within radius meters, {} if there is none,
+                    None if the index is stale and DynamoDB has to be queried
+        """
+        if self.is_stale():
+            return None
+        cells = self.grid.get(oem)
+        if not cells:
+            return {}
+        lat_span = math.degrees(radius / EARTH_RADIUS_METERS)
+        cos_lat = max(math.cos(math.radians(min(abs(lat) + lat_span, 89.9))), 1e-6)
+        lon_span = lat_span / cos_lat
+        best, best_distance = None, radius
+        for lat_cell in range(math.floor(lat - lat_span), math.floor(lat + lat_span) + 1):
+            for lon_cell in range(math.floor(lon - lon_span), math.floor(lon + lon_span) + 1):
+                for dealer_lat, dealer_lon, dealer in cells.get((lat_cell, lon_cell), ()):
+                    distance = haversine_meters(lat, lon, dealer_lat, dealer_lon)
+                    if distance < best_distance:
+                        best, best_distance = dealer, distance
+        if best is None:
+            return {}
+        return vendor_from_dealer(best)
+
+    def start_refresher(self, interval: float = DEALER_INDEX_REFRESH_INTERVAL):
+        if self.refresher is not None:
+            return
+        self.stop_event.clear()
+
+        def run():
+            while not self.stop_event.is_set():
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.error(f"Dealer index refresh failed: {e}")
+                self.stop_event.wait(interval)
+
+        self.refresher = threading.Thread(target=run, name="dealer-index-refresher", daemon=True)
+        self.refresher.start()
+
+    def stop_refresher(self):
+        self.stop_event.set()
+        self.refresher = None
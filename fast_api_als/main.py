@@ -1,8 +1,23 @@
+import os
 import time
+import uuid
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fast_api_als.routers import users, submit_lead, lead_conversion, reinforcement, oem, three_pl, quicksight
+from fast_api_als.routers import users, submit_lead, lead_conversion, reinforcement, oem, three_pl, quicksight, \
+    lead_export
+from fast_api_als.database.async_db_helper import async_db_helper_session
+from fast_api_als.database.db_helper import db_helper_session
+from fast_api_als.services.enrich_lead import close_enrichment_executor
+from fast_api_als.services.verify_phone_and_email import start_http_client, close_http_client
+from fast_api_als.utils.logging_config import setup_logging, stop_logging, bind_log_context
+from fast_api_als.utils.metrics import metrics_registry
+from fast_api_als.utils.quicksight_uploader import quicksight_uploader
+from fast_api_als.utils.sqs_publisher import sqs_publisher
+from fast_api_als.utils.zipcode_index import get_zipcode_index
+
+# set APP_WARM_UP=false to skip the warm-up queries, e.g. in tests
+APP_WARM_UP = os.getenv('APP_WARM_UP', 'true').lower() == 'true'
 
 app = FastAPI()
 app.include_router(users.router)
@@ -12,6 +27,7 @@ app.include_router(reinforcement.router)
 app.include_router(oem.router)
 app.include_router(three_pl.router)
 app.include_router(quicksight.router)
+app.include_router(lead_export.router)
 
 # only present during test development
 # app.include_router(test_api.router)
@@ -26,6 +42,42 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def request_context(request: Request, call_next):
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    bind_log_context(request_id=request_id)
+    response = await call_next(request)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+
+@app.on_event("startup")
+async def startup():
+    start = time.perf_counter()
+    setup_logging()
+    db_helper_session.initialize(warm_up=APP_WARM_UP)
+    async_db_helper_session.start()
+    sqs_publisher.start()
+    quicksight_uploader.start()
+    start_http_client()
+    if APP_WARM_UP:
+        get_zipcode_index()
+    db_helper_session.dealer_index.start_refresher()
+    # cold start cost is tracked on /metrics like any other stage
+    metrics_registry.observe("app.startup", (time.perf_counter() - start) * 1000.0)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await sqs_publisher.stop()
+    await quicksight_uploader.stop()
+    db_helper_session.dealer_index.stop_refresher()
+    close_enrichment_executor()
+    async_db_helper_session.shutdown()
+    await close_http_client()
+    stop_logging()
+
+
 @app.get("/")
 def root():
     return {"message": "Welcome to jTU"}
@@ -36,3 +88,8 @@ def ping():
     start = time.process_time()
     time_taken = (time.process_time() - start) * 1000
     return {f"Pong with response time {time_taken} ms"}
+
+
+@app.get("/metrics")
+def metrics():
+    return metrics_registry.snapshot()
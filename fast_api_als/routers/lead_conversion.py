@@ -6,8 +6,8 @@ import time
 from fastapi import Request
 from starlette import status
 
-from fast_api_als.database.db_helper import db_helper_session
-from fast_api_als.quicksight.s3_helper import s3_helper_client
+from fast_api_als.database.async_db_helper import async_db_helper_session
+from fast_api_als.utils.quicksight_uploader import quicksight_uploader
 from fast_api_als.services.authenticate import get_token
 from fast_api_als.utils.cognito_client import get_user_role
 
@@ -57,10 +57,10 @@ async def submit(file: Request, token: str = Depends(get_token)):
         # throw proper HTTPException
         pass
 
-    is_updated, item = db_helper_session.update_lead_conversion(lead_uuid, oem, converted)
+    is_updated, item = await async_db_helper_session.update_lead_conversion(lead_uuid, oem, converted)
     if is_updated:
         data, path = get_quicksight_data(lead_uuid, item)
-        s3_helper_client.put_file(data, path)
+        quicksight_uploader.add(data, path)
         return {
             "status_code": status.HTTP_200_OK,
             "message": "Lead Conversion Status Update"
@@ -0,0 +1,84 @@
+import json
+import logging
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from starlette.status import (HTTP_400_BAD_REQUEST, HTTP_401_UNAUTHORIZED, HTTP_403_FORBIDDEN,
+                              HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+from fast_api_als.database.async_db_helper import async_db_helper_session
+from fast_api_als.services.authenticate import get_token
+from fast_api_als.utils.cognito_client import get_user_role
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+EXPORT_PAGE_SIZE = 500
+EXPORT_ACK_MAX_LEADS = 1000
+
+
+async def stream_unsent_leads(oem: str, date: str):
+    pages = async_db_helper_session.db_helper.accepted_lead_pages_not_sent_for_oem(oem, date, EXPORT_PAGE_SIZE)
+    exported = 0
+    while True:
+        # pages are fetched on the db executor, the event loop only serializes them
+        page = await async_db_helper_session.run(next, pages, None)
+        if page is None:
+            break
+        if page:
+            yield ''.join(json.dumps(item, default=str) + '\n' for item in page)
+            exported += len(page)
+    logger.info(f"Exported {exported} unsent leads of {oem} for {date}")
+
+
+def get_oem(token: str) -> str:
+    oem, role = get_user_role(token)
+    if role != "OEM":
+        raise HTTPException(status_code=HTTP_401_UNAUTHORIZED, detail="Only OEMs can export their leads")
+    return oem
+
+
+@router.get("/export/unsent_leads")
+async def export_unsent_leads(date: str = None, token: str = Depends(get_token)):
+    """
+            Streams the accepted leads not yet sent to the calling OEM as NDJSON.
+            The leads stay unsent until they are acknowledged with POST /export/unsent_leads/ack.
+            Args:
+                date: day of the leads as YYYY-MM-DD, today if not given
+    """
+    oem = get_oem(token)
+    if date is None:
+        date = datetime.today().strftime('%Y-%m-%d')
+    return StreamingResponse(stream_unsent_leads(oem, date), media_type="application/x-ndjson")
+
+
+@router.post("/export/unsent_leads/ack")
+async def acknowledge_unsent_leads(file: Request, token: str = Depends(get_token)):
+    """
+            Marks exported leads as sent.
+            Body is {"leads": [{"pk": ..., "sk": ...}]} with the keys of the exported leads.
+            Returns:
+                number of leads marked, already sent or converted, and the keys that could not be marked
+    """
+    oem = get_oem(token)
+    body = await file.body()
+    try:
+        leads = json.loads(str(body, 'utf-8'))['leads']
+        keys = [(lead['pk'], lead['sk']) for lead in leads]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail="Body must be {\"leads\": [{\"pk\", \"sk\"}]}")
+    if len(keys) > EXPORT_ACK_MAX_LEADS:
+        raise HTTPException(status_code=HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"At most {EXPORT_ACK_MAX_LEADS} leads per acknowledgement")
+    if any(not isinstance(pk, str) or not isinstance(sk, str) or not pk.startswith(f"{oem}#") for pk, sk in keys):
+        raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail="Leads of other OEMs can not be acknowledged")
+
+    marked, skipped, failed = await async_db_helper_session.mark_leads_sent(keys)
+    if failed:
+        logger.error(f"{len(failed)} exported leads of {oem} not marked as sent")
+    return {
+        "marked": marked,
+        "not_unsent": skipped,
+        "failed": [{"pk": pk, "sk": sk} for pk, sk in failed]
+    }
@@ -1,12 +1,12 @@
-import time
+import json
 import uuid
+import asyncio
 import logging
 
 from datetime import datetime
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException
 from fastapi import Request, Depends
 from fastapi.security.api_key import APIKey
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from fast_api_als.services.authenticate import get_api_key
 from fast_api_als.services.enrich.customer_info import get_contact_details
@@ -15,13 +15,31 @@ from fast_api_als.services.enrich_lead import get_enriched_lead_json
 from fast_api_als.services.new_verify_phone_and_email import new_verify_phone_and_email
 from fast_api_als.utils.adf import parse_xml, check_validation
 from fast_api_als.utils.calculate_lead_hash import calculate_lead_hash
-from fast_api_als.database.db_helper import db_helper_session
+from fast_api_als.database.async_db_helper import async_db_helper_session
 from fast_api_als.services.ml_helper import conversion_to_ml_input, score_ml_input
 from fast_api_als.utils.quicksight_utils import create_quicksight_data
-from fast_api_als.quicksight.s3_helper import s3_helper_client
-from fast_api_als.utils.sqs_utils import sqs_helper_session
+from fast_api_als.utils.quicksight_uploader import quicksight_uploader
+from fast_api_als.utils.sqs_publisher import sqs_publisher
+from fast_api_als.utils.logging_config import bind_log_context
+from fast_api_als.utils.metrics import StageTimer, metrics_registry
+from fast_api_als.utils.single_flight import SingleFlight
+from fast_api_als.utils.zipcode_index import get_zipcode_index
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+BATCH_SUBMIT_MAX_LEADS = 1000
+BATCH_SUBMIT_CONCURRENCY = 32
+# the exception text stays in the log, 3PLs only get a fixed code
+BATCH_LEAD_ERROR = {
+    "status": "ERROR",
+    "code": "99_INTERNAL_ERROR",
+    "message": "Lead could not be processed"
+}
+
+# concurrent submits of the same lead by the same 3PL share one pipeline run
+lead_flights = SingleFlight()
+metrics_registry.register_gauge("submit_in_flight_leads", lead_flights.in_flight)
 
 """
 Add proper logging and exception handling.
@@ -33,49 +51,230 @@ you will get the idea about the part when you go through the code.
 
 @router.post("/submit/")
 async def submit(file: Request, apikey: APIKey = Depends(get_api_key)):
-    start = int(time.time() * 1000.0)
-    t1 = [int(time.time() * 1000.0)]
-    
-    if not db_helper_session.verify_api_key(apikey):
+    timer = StageTimer("submit")
+    try:
+        return await process_submit(file, apikey, timer)
+    finally:
+        timer.finish()
+
+
+async def process_submit(file: Request, apikey: APIKey, timer: StageTimer):
+    with timer.stage("verify_api_key"):
+        api_key_verified = await async_db_helper_session.verify_api_key(apikey)
+    if not api_key_verified:
         # throw proper fastpi.HTTPException
         pass
     
     body = await file.body()
     body = str(body, 'utf-8')
 
-    obj = parse_xml(body)
+    return await process_lead(body, apikey, timer, send_lead_message)
+
+
+@router.post("/submit/batch")
+async def submit_batch(file: Request, apikey: APIKey = Depends(get_api_key)):
+    """
+            Submits many leads in one request.
+            Body is NDJSON, one JSON encoded ADF XML string per line.
+            Returns:
+                one response per line, in the order of the lines
+    """
+    timer = StageTimer("submit_batch")
+    try:
+        with timer.stage("verify_api_key"):
+            api_key_verified = await async_db_helper_session.verify_api_key(apikey)
+        if not api_key_verified:
+            # throw proper fastpi.HTTPException
+            pass
+
+        body = await file.body()
+        lines = [line for line in str(body, 'utf-8').splitlines() if line.strip()]
+        if len(lines) > BATCH_SUBMIT_MAX_LEADS:
+            raise HTTPException(status_code=413, detail=f"At most {BATCH_SUBMIT_MAX_LEADS} leads per batch")
+        timer.context['leads'] = len(lines)
+
+        semaphore = asyncio.Semaphore(BATCH_SUBMIT_CONCURRENCY)
+
+        async def prepare_line(line):
+            try:
+                adf_xml = json.loads(line)
+            except ValueError:
+                adf_xml = None
+            if not isinstance(adf_xml, str):
+                return None, None, None, {
+                    "status": "REJECTED",
+                    "code": "1_INVALID_XML",
+                    "message": "Line is not a JSON encoded ADF XML string"
+                }
+            lead_timer = StageTimer("submit")
+            try:
+                async with semaphore:
+                    obj, lead_hash, rejection = await prepare_lead(adf_xml, apikey, lead_timer)
+            except Exception:
+                lead_timer.finish()
+                logger.exception("Lead in batch failed")
+                return None, None, None, dict(BATCH_LEAD_ERROR)
+            if rejection is not None:
+                lead_timer.finish()
+            return obj, lead_hash, lead_timer, rejection
+
+        with timer.stage("prepare_leads"):
+            prepared = await asyncio.gather(*(prepare_line(line) for line in lines))
+
+        # one BatchGetItem for the duplicate api call check of every valid lead in the batch
+        leads = [(lead_hash, obj['adf']['prospect']['provider']['service'])
+                 for obj, lead_hash, _, rejection in prepared if rejection is None]
+        duplicate_api_calls = {}
+        if leads:
+            try:
+                with timer.stage("check_duplicate_api_calls"):
+                    duplicate_api_calls = await async_db_helper_session.check_duplicate_api_calls(leads)
+            except Exception:
+                logger.exception("Batched duplicate api call check failed, checking leads one by one")
+
+        # the OEM data once per make instead of once per lead
+        makes = list(dict.fromkeys(obj['adf']['prospect']['vehicle']['make']
+                                   for obj, _, _, rejection in prepared if rejection is None))
+        with timer.stage("fetch_oem_data"):
+            fetched = await asyncio.gather(*(async_db_helper_session.fetch_oem_data(make, True) for make in makes),
+                                           return_exceptions=True)
+        oem_data = {make: data for make, data in zip(makes, fetched) if not isinstance(data, Exception)}
+
+        async def submit_prepared(obj, lead_hash, lead_timer, rejection):
+            if rejection is not None:
+                return rejection
+            provider = obj['adf']['prospect']['provider']['service']
+            try:
+                async with semaphore:
+                    return await run_lead(obj, lead_hash, lead_timer, send_lead_message,
+                                          duplicate_api_calls.get((lead_hash, provider)),
+                                          oem_data.get(obj['adf']['prospect']['vehicle']['make']))
+            except Exception:
+                logger.exception("Lead in batch failed")
+                return dict(BATCH_LEAD_ERROR)
+            finally:
+                lead_timer.finish()
+
+        return await asyncio.gather(*(submit_prepared(*lead) for lead in prepared))
+    finally:
+        timer.finish()
+
+
+async def send_lead_message(message: dict, timer: StageTimer):
+    # only waits for room in the publisher queue, not for SQS
+    with timer.stage("sqs_send"):
+        await sqs_publisher.publish(message)
+
+
+async def process_lead(body: str, apikey: APIKey, timer: StageTimer, send_message):
+    obj, lead_hash, rejection = await prepare_lead(body, apikey, timer)
+    if rejection is not None:
+        return rejection
+    return await run_lead(obj, lead_hash, timer, send_message)
+
+
+async def prepare_lead(body: str, apikey: APIKey, timer: StageTimer):
+    """
+            Parses, hashes and validates a lead.
+            Returns:
+                (parsed lead, lead hash, None) for a valid lead, (parsed lead, lead hash, rejection response) otherwise
+    """
+    with timer.stage("parse_xml"):
+        obj = parse_xml(body)
 
     # check if xml was not parsable, if not return
     if not obj:
-        provider = db_helper_session.get_api_key_author(apikey)
+        provider = await async_db_helper_session.get_api_key_author(apikey)
         obj = {
             'provider': {
                 'service': provider
             }
         }
         item, path = create_quicksight_data(obj, 'unknown_hash', 'REJECTED', '1_INVALID_XML', {})
-        s3_helper_client.put_file(item, path)
-        return {
+        quicksight_uploader.add(item, path)
+        return obj, None, {
             "status": "REJECTED",
             "code": "1_INVALID_XML",
             "message": "Error occured while parsing XML"
         }
     
-    lead_hash = calculate_lead_hash(obj)
+    with timer.stage("calculate_lead_hash"):
+        lead_hash = calculate_lead_hash(obj)
+    timer.context['lead_hash'] = lead_hash
+    bind_log_context(lead_hash=lead_hash)
 
     # check if adf xml is valid
-    validation_check, validation_code, validation_message = check_validation(obj)
+    with timer.stage("check_validation"):
+        validation_check, validation_code, validation_message = check_validation(obj)
 
     #if not valid return
     if not validation_check:
         item, path = create_quicksight_data(obj['adf']['prospect'], lead_hash, 'REJECTED', validation_code, {})
-        s3_helper_client.put_file(item, path)
-        return {
+        quicksight_uploader.add(item, path)
+        return obj, lead_hash, {
             "status": "REJECTED",
             "code": validation_code,
             "message": validation_message
         }
+    return obj, lead_hash, None
+
+
+async def run_lead(obj: dict, lead_hash: str, timer: StageTimer, send_message, duplicate_api_call: dict = None,
+                   oem_data: dict = None):
+    """
+            Runs a validated lead through the pipeline.
+            Args:
+                duplicate_api_call: check_duplicate_api_call result when it was already fetched, e.g. in a batch
+                oem_data: fetch_oem_data(make, True) result when it was already fetched
+    """
+    bind_log_context(lead_hash=lead_hash)
+    flight_key = (lead_hash, obj['adf']['prospect']['provider']['service'])
+    if flight_key in lead_flights.calls:
+        timer.context['coalesced'] = True
+    with timer.stage("pipeline"):
+        response_body = await lead_flights.do(flight_key,
+                                              lambda: process_valid_lead(obj, lead_hash, timer, send_message,
+                                                                         duplicate_api_call, oem_data))
+    return dict(response_body)
 
+
+async def score_lead(obj: dict, make: str, dealer_available: bool, timer: StageTimer):
+    """
+            Finds the nearest dealer if the lead has none, enriches and scores the lead.
+            Returns:
+                (model input, dealer_available, score)
+    """
+    # if dealer is not available then find nearest dealer
+    if not dealer_available:
+        with timer.stage("nearest_dealer"):
+            postalcode = obj['adf']['prospect']['customer']['contact']['address']['postalcode']
+            coordinates = get_zipcode_index().coordinates(postalcode)
+            if coordinates is None:
+                coordinates = get_customer_coordinate(postalcode)
+            lat, lon = coordinates
+            nearest_vendor = await async_db_helper_session.fetch_nearest_dealer(oem=make,
+                                                                                lat=lat,
+                                                                                lon=lon)
+        obj['adf']['prospect']['vendor'] = nearest_vendor
+        dealer_available = True if nearest_vendor != {} else False
+
+    # enrich the lead, off the event loop so it overlaps with the duplicate checks
+    with timer.stage("enrichment"):
+        model_input = await async_db_helper_session.run(get_enriched_lead_json, obj)
+
+    with timer.stage("ml_scoring"):
+        # convert the enriched lead to ML input format
+        ml_input = conversion_to_ml_input(model_input, make, dealer_available)
+
+        # score the lead, off the event loop
+        result = await asyncio.get_running_loop().run_in_executor(None, score_ml_input, ml_input, make,
+                                                                  dealer_available)
+
+    return model_input, dealer_available, result
+
+
+async def process_valid_lead(obj: dict, lead_hash: str, timer: StageTimer, send_message,
+                             duplicate_api_call: dict = None, oem_data: dict = None):
     # check if vendor is available here
     dealer_available = True if obj['adf']['prospect'].get('vendor', None) else False
     email, phone, last_name = get_contact_details(obj)
@@ -83,17 +282,39 @@ async def submit(file: Request, apikey: APIKey = Depends(get_api_key)):
     model = obj['adf']['prospect']['vehicle']['model']
 
 
+    provider = obj['adf']['prospect']['provider']['service']
     fetched_oem_data = {}
 
+    if duplicate_api_call is not None and duplicate_api_call['Duplicate_Api_Call']['status']:
+        return {
+            "status": f"Already {duplicate_api_call['Duplicate_Api_Call']['response']}",
+            "message": "Duplicate Api Call"
+        }
+
+    # scoring does not depend on the checks below, start it speculatively next to them
+    # and drop it if the lead turns out to be a duplicate
+    scoring = asyncio.create_task(score_lead(obj, make, dealer_available, timer))
+
     # check if 3PL is making a duplicate call or it is a duplicate lead
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        futures = [executor.submit(db_helper_session.check_duplicate_api_call, lead_hash,
-                                   obj['adf']['prospect']['provider']['service']),
-                   executor.submit(db_helper_session.check_duplicate_lead, email, phone, last_name, make, model),
-                   executor.submit(db_helper_session.fetch_oem_data, make, True)
-                   ]
-        for future in as_completed(futures):
-            result = future.result()
+    tasks = [
+        asyncio.create_task(timer.timed_async("check_duplicate_lead",
+                                              async_db_helper_session.check_duplicate_lead(
+                                                  email, phone, last_name, make, model)))
+    ]
+    # a batch submit already fetched the OEM data and the duplicate api call check
+    if oem_data is None:
+        tasks.append(asyncio.create_task(timer.timed_async("fetch_oem_data",
+                                                           async_db_helper_session.fetch_oem_data(make, True))))
+    else:
+        fetched_oem_data = oem_data.get('fetch_oem_data', {})
+    if duplicate_api_call is None:
+        tasks.append(asyncio.create_task(timer.timed_async("check_duplicate_api_call",
+                                                           async_db_helper_session.check_duplicate_api_call(
+                                                               lead_hash, provider))))
+    lead_rejected = True
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
             if result.get('Duplicate_Api_Call', {}).get('status', False):
                 return {
                     "status": f"Already {result['Duplicate_Api_Call']['response']}",
@@ -107,37 +328,30 @@ async def submit(file: Request, apikey: APIKey = Depends(get_api_key)):
                 }
             if "fetch_oem_data" in result:
                 fetched_oem_data = result['fetch_oem_data']
-    if fetched_oem_data == {}:
-        return {
-            "status": "REJECTED",
-            "code": "20_OEM_DATA_NOT_FOUND",
-            "message": "OEM data not found"
-        }
-    if 'threshold' not in fetched_oem_data:
-        return {
-            "status": "REJECTED",
-            "code": "20_OEM_DATA_NOT_FOUND",
-            "message": "OEM data not found"
-        }
+        if fetched_oem_data == {}:
+            return {
+                "status": "REJECTED",
+                "code": "20_OEM_DATA_NOT_FOUND",
+                "message": "OEM data not found"
+            }
+        if 'threshold' not in fetched_oem_data:
+            return {
+                "status": "REJECTED",
+                "code": "20_OEM_DATA_NOT_FOUND",
+                "message": "OEM data not found"
+            }
+        lead_rejected = False
+    finally:
+        # on an early return the remaining lookups and the speculative scoring are no longer needed,
+        # they are awaited so their cancellation or failure is retrieved instead of logged as unhandled
+        abandoned = tasks + [scoring] if lead_rejected else tasks
+        for task in abandoned:
+            task.cancel()
+        await asyncio.gather(*abandoned, return_exceptions=True)
     oem_threshold = float(fetched_oem_data['threshold'])
 
-    # if dealer is not available then find nearest dealer
-    if not dealer_available:
-        lat, lon = get_customer_coordinate(obj['adf']['prospect']['customer']['contact']['address']['postalcode'])
-        nearest_vendor = db_helper_session.fetch_nearest_dealer(oem=make,
-                                                                lat=lat,
-                                                                lon=lon)
-        obj['adf']['prospect']['vendor'] = nearest_vendor
-        dealer_available = True if nearest_vendor != {} else False
-
-    # enrich the lead
-    model_input = get_enriched_lead_json(obj)
-
-    # convert the enriched lead to ML input format
-    ml_input = conversion_to_ml_input(model_input, make, dealer_available)
-
-    # score the lead
-    result = score_ml_input(ml_input, make, dealer_available)
+    with timer.stage("await_scoring"):
+        model_input, dealer_available, result = await scoring
 
     # create the response
     response_body = {}
@@ -150,7 +364,8 @@ async def submit(file: Request, apikey: APIKey = Depends(get_api_key)):
 
     # verify the customer
     if response_body['status'] == 'ACCEPTED':
-        contact_verified = await new_verify_phone_and_email(email, phone)
+        with timer.stage("contact_verification"):
+            contact_verified = await new_verify_phone_and_email(email, phone)
         if not contact_verified:
             response_body['status'] = 'REJECTED'
             response_body['code'] = '17_FAILED_CONTACT_VALIDATION'
@@ -161,7 +376,7 @@ async def submit(file: Request, apikey: APIKey = Depends(get_api_key)):
     # insert the lead into ddb with oem & customer details
     # delegate inserts to sqs queue
     if response_body['status'] == 'ACCEPTED':
-        make_model_filter = db_helper_session.get_make_model_filter_status(make)
+        make_model_filter = await async_db_helper_session.get_make_model_filter_status(make)
         message = {
             'put_file': {
                 'item': item,
@@ -196,7 +411,7 @@ async def submit(file: Request, apikey: APIKey = Depends(get_api_key)):
                 'model': model
             }
         }
-        res = sqs_helper_session.send_message(message)
+        await send_message(message, timer)
 
     else:
         message = {
@@ -210,9 +425,6 @@ async def submit(file: Request, apikey: APIKey = Depends(get_api_key)):
                 'response': response_body['status']
             }
         }
-        res = sqs_helper_session.send_message(message)
-    time_taken = (int(time.time() * 1000.0) - start)
-
-    response_message = f"{result} Response Time : {time_taken} ms"
+        await send_message(message, timer)
 
     return response_body
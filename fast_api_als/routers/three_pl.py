@@ -3,7 +3,7 @@ import logging
 from fastapi import Request
 
 from fastapi import APIRouter, HTTPException, Depends
-from fast_api_als.database.db_helper import db_helper_session
+from fast_api_als.database.async_db_helper import async_db_helper_session
 from fast_api_als.services.authenticate import get_token
 from fast_api_als.utils.cognito_client import get_user_role
 from starlette.status import HTTP_200_OK, HTTP_401_UNAUTHORIZED
@@ -20,7 +20,7 @@ async def reset_authkey(request: Request, token: str = Depends(get_token)):
         pass
     if role == "ADMIN":
         provider = body['3pl']
-    apikey = db_helper_session.set_auth_key(username=provider)
+    apikey = await async_db_helper_session.set_auth_key(username=provider)
     return {
         "status_code": HTTP_200_OK,
         "x-api-key": apikey
@@ -37,7 +37,7 @@ async def view_authkey(request: Request, token: str = Depends(get_token)):
         pass
     if role == "ADMIN":
         provider = body['3pl']
-    apikey = db_helper_session.get_auth_key(username=provider)
+    apikey = await async_db_helper_session.get_auth_key(username=provider)
     return {
         "status_code": HTTP_200_OK,
         "x-api-key": apikey
@@ -1,8 +1,13 @@
 import calendar
 import time
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from dateutil import parser
 from fast_api_als.database.db_helper import db_helper_session
+from fast_api_als.services.enrich.demographic_data import get_customer_coordinate
+from fast_api_als.utils.geo import haversine_meters
+from fast_api_als.utils.zipcode_index import get_zipcode_index
 
 from fast_api_als import constants
 
@@ -10,6 +15,103 @@ from fast_api_als import constants
 what exceptions can be thrown here?
 """
 
+logger = logging.getLogger(__name__)
+
+# lookups of one lead run concurrently, a source that is not back in time is left out
+ENRICHMENT_WORKERS = 16
+ENRICHMENT_TIMEOUT = 1.0
+enrichment_executor = None
+enrichment_executor_lock = threading.Lock()
+
+
+def get_enrichment_executor() -> ThreadPoolExecutor:
+    global enrichment_executor
+    if enrichment_executor is None:
+        with enrichment_executor_lock:
+            if enrichment_executor is None:
+                enrichment_executor = ThreadPoolExecutor(max_workers=ENRICHMENT_WORKERS, thread_name_prefix="enrich")
+    return enrichment_executor
+
+
+def close_enrichment_executor():
+    global enrichment_executor
+    with enrichment_executor_lock:
+        if enrichment_executor is not None:
+            enrichment_executor.shutdown(wait=False)
+            enrichment_executor = None
+
+
+def get_dealer_code(adf_json: dict):
+    dealer_id = (adf_json['adf']['prospect'].get('vendor') or {}).get('id')
+    if isinstance(dealer_id, list):
+        dealer_id = dealer_id[0] if dealer_id else None
+    if isinstance(dealer_id, dict):
+        dealer_id = dealer_id.get('#text')
+    return dealer_id
+
+
+def get_coordinates(postalcode: str):
+    if not postalcode:
+        return None
+    coordinates = get_zipcode_index().coordinates(postalcode)
+    if coordinates is None:
+        coordinates = get_customer_coordinate(postalcode)
+    return coordinates
+
+
+def fetch_enrichment_sources(adf_json: dict, timeout: float = ENRICHMENT_TIMEOUT) -> dict:
+    """
+            Fetches the external data enrichment needs for a lead, all lookups at once.
+            Args:
+                adf_json: parsed and validated ADF lead
+                timeout: seconds to wait for the slowest lookup
+            Returns:
+                {'dealer': dealer data, 'coordinates': customer (lat, lon), 'dealer_coordinates': (lat, lon)},
+                {} / None for sources that failed or timed out
+    """
+    prospect = adf_json['adf']['prospect']
+    executor = get_enrichment_executor()
+    futures = {
+        'dealer': executor.submit(db_helper_session.get_dealer_data, get_dealer_code(adf_json),
+                                  prospect['vehicle']['make']),
+        'coordinates': executor.submit(get_coordinates, prospect['customer']['contact']['address']['postalcode']),
+        'dealer_coordinates': executor.submit(get_coordinates, get_dealer_postalcode(adf_json))
+    }
+    defaults = {'dealer': {}, 'coordinates': None, 'dealer_coordinates': None}
+    wait(futures.values(), timeout=timeout)
+    sources = {}
+    for name, future in futures.items():
+        if not future.done():
+            future.cancel()
+            logger.warning(f"Enrichment source {name} timed out after {timeout}s")
+            sources[name] = defaults[name]
+        elif future.exception() is not None:
+            logger.error(f"Enrichment source {name} failed: {future.exception()}")
+            sources[name] = defaults[name]
+        else:
+            sources[name] = future.result()
+    return sources
+
+
+def get_dealer_postalcode(adf_json: dict):
+    vendor = adf_json['adf']['prospect'].get('vendor') or {}
+    return ((vendor.get('contact') or {}).get('address') or {}).get('postalcode')
+
 
 def get_enriched_lead_json(adf_json: dict) -> dict:
-    pass
\ No newline at end of file
+    """
+            Returns the lead with its enrichment data. The ADF structure the model input is converted
+            from is kept as it is, the fetched sources are added next to it under 'enrichment'.
+            Args:
+                adf_json: parsed and validated ADF lead
+            Returns:
+                {**adf_json, 'enrichment': {'dealer', 'coordinates', 'dealer_coordinates', 'dealer_distance'}},
+                dealer_distance in km, None when a location is unknown
+    """
+    sources = fetch_enrichment_sources(adf_json)
+    coordinates = sources['coordinates']
+    dealer_coordinates = sources['dealer_coordinates']
+    dealer_distance = None
+    if coordinates is not None and dealer_coordinates is not None:
+        dealer_distance = round(haversine_meters(*coordinates, *dealer_coordinates) / 1000.0, 1)
+    return {**adf_json, 'enrichment': {**sources, 'dealer_distance': dealer_distance}}
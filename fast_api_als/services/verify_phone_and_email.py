@@ -1,3 +1,4 @@
+import re
 import time
 import httpx
 import asyncio
@@ -7,22 +8,103 @@ from fast_api_als.constants import (
     ALS_DATA_TOOL_PHONE_VERIFY_METHOD,
     ALS_DATA_TOOL_SERVICE_URL,
     ALS_DATA_TOOL_REQUEST_KEY)
+from fast_api_als.utils.metrics import metrics_registry
+from fast_api_als.utils.single_flight import SingleFlight
+from fast_api_als.utils.ttl_cache import TTLCache
 
 """
 How can you write log to understand what's happening in the code?
 You also trying to undderstand the execution time factor.
 """
 
-async def call_validation_service(url: str, topic: str, value: str, data: dict) -> None:  # 2
+# one pooled client for the whole app, created on startup and closed on shutdown in main.py
+HTTP_MAX_CONNECTIONS = 100
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 20
+HTTP_KEEPALIVE_EXPIRY = 30.0
+HTTP_CONNECT_TIMEOUT = 2.0
+VALIDATION_SERVICE_TIMEOUT = 5.0
+
+# verdicts per normalized email/phone, invalid contacts are re-checked sooner
+VERIFICATION_CACHE_SIZE = 50000
+VERIFICATION_CACHE_TTL = 24 * 60 * 60
+VERIFICATION_CACHE_NEGATIVE_TTL = 60 * 60
+
+http_client = None
+verification_cache = TTLCache(VERIFICATION_CACHE_SIZE, VERIFICATION_CACHE_TTL, VERIFICATION_CACHE_NEGATIVE_TTL)
+metrics_registry.register_gauge("contact_verification_cache", verification_cache.stats)
+in_flight_verifications = SingleFlight()
+
+
+def start_http_client() -> httpx.AsyncClient:
+    global http_client
+    if http_client is None:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(VALIDATION_SERVICE_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+        )
+    return http_client
+
+
+async def close_http_client() -> None:
+    global http_client
+    if http_client is not None:
+        client, http_client = http_client, None
+        await client.aclose()
+
+
+async def call_validation_service(url: str, topic: str, value: str, data: dict,
+                                  timeout: float = VALIDATION_SERVICE_TIMEOUT) -> None:  # 2
     if value == '':
         return
-    async with httpx.AsyncClient() as client:  # 3
-        response = await client.get(url)
+    client = start_http_client()
+    response = await client.get(url, timeout=httpx.Timeout(timeout, connect=HTTP_CONNECT_TIMEOUT))  # 3
 
     r = response.json()
     data[topic] = r
     
 
+def normalize_email(email: str) -> str:
+    return email.strip().lower()
+
+
+def normalize_phone(phone_number: str) -> str:
+    return re.sub(r'\D', '', phone_number)
+
+
+def is_email_valid(data: dict) -> bool:
+    return data["DtResponse"]["Result"][0]["StatusCode"] in ("0", "1")
+
+
+def is_phone_valid(data: dict) -> bool:
+    return data["DtResponse"]["Result"][0]["IsValid"] == "True"
+
+
+async def fetch_verdict(url: str, topic: str, value: str, key: tuple, is_valid) -> bool:
+    data = {}
+    await call_validation_service(url, topic, value, data)
+    verdict = is_valid(data[topic])
+    if verdict:
+        verification_cache.set(key, verdict)
+    else:
+        verification_cache.set_negative(key, verdict)
+    return verdict
+
+
+async def verify_contact(url: str, topic: str, value: str, normalized: str, is_valid) -> bool:
+    if value == '':
+        return False
+    key = (topic, normalized)
+    hit, verdict = verification_cache.lookup(key)
+    if hit:
+        return verdict
+    # concurrent leads for the same contact share one call to the data tool
+    return await in_flight_verifications.do(key, lambda: fetch_verdict(url, topic, value, key, is_valid))
+
+
 async def verify_phone_and_email(email: str, phone_number: str) -> bool:
     email_validation_url = '{}?Method={}&RequestKey={}&EmailAddress={}&OutputFormat=json'.format(
         ALS_DATA_TOOL_SERVICE_URL,
@@ -34,18 +116,9 @@ async def verify_phone_and_email(email: str, phone_number: str) -> bool:
         ALS_DATA_TOOL_PHONE_VERIFY_METHOD,
         ALS_DATA_TOOL_REQUEST_KEY,
         phone_number)
-    email_valid = False
-    phone_valid = False
-    data = {}
 
-    await asyncio.gather(
-        call_validation_service(email_validation_url, "email", email, data),
-        call_validation_service(phone_validation_url, "phone", phone_number, data),
+    email_valid, phone_valid = await asyncio.gather(
+        verify_contact(email_validation_url, "email", email, normalize_email(email), is_email_valid),
+        verify_contact(phone_validation_url, "phone", phone_number, normalize_phone(phone_number), is_phone_valid),
     )
-    if "email" in data:
-        if data["email"]["DtResponse"]["Result"][0]["StatusCode"] in ("0", "1"):
-            email_valid = True
-    if "phone" in data:
-        if data["phone"]["DtResponse"]["Result"][0]["IsValid"] == "True":
-            phone_valid = True
     return email_valid | phone_valid
@@ -1,15 +1,21 @@
+import os
 import xmltodict
-from jsonschema import validate, draft7_format_checker
+from jsonschema import draft7_format_checker, validators
+from jsonschema.exceptions import best_match
 import logging
-from uszipcode import SearchEngine
 import re
 
+from fast_api_als.utils.adf_etree import parse_adf_etree
+from fast_api_als.utils.zipcode_index import get_zipcode_index
+
 
 
 # ISO8601 datetime regex
 regex = r'^(-?(?:[1-9][0-9]*)?[0-9]{4})-(1[0-2]|0[1-9])-(3[01]|0[1-9]|[12][0-9])T(2[0-3]|[01][0-9]):([0-5][0-9]):([0-5][0-9])(\.[0-9]+)?(Z|[+-](?:2[0-3]|[01][0-9]):[0-5][0-9])?$'
 match_iso8601 = re.compile(regex).match
-zipcode_search = SearchEngine()
+# 'xmltodict' or 'etree', both return the same structure
+ADF_PARSER_BACKEND = os.getenv('ADF_PARSER_BACKEND', 'xmltodict')
+adf_validator = None
 
 
 def process_before_validating(input_json):
@@ -39,10 +45,29 @@ def is_nan(x):
 
 def parse_xml(adf_xml):
     # use exception handling
+    if ADF_PARSER_BACKEND == 'etree':
+        return parse_adf_etree(adf_xml)
     obj = xmltodict.parse(adf_xml)
     return obj
 
 
+def get_adf_validator():
+    # check the schema and build its validator once instead of on every lead
+    global adf_validator
+    if adf_validator is None:
+        validator_class = validators.validator_for(schema)
+        validator_class.check_schema(schema)
+        adf_validator = validator_class(schema, format_checker=draft7_format_checker)
+    return adf_validator
+
+
+def validate_adf_schema(input_json):
+    # same error jsonschema.validate() raises
+    error = best_match(get_adf_validator().iter_errors(input_json))
+    if error is not None:
+        raise error
+
+
 def validate_adf_values(input_json):
     input_json = input_json['adf']['prospect']
     zipcode = input_json['customer']['contact']['address']['postalcode']
@@ -65,8 +90,7 @@ def validate_adf_values(input_json):
         return {"status": "REJECTED", "code": "6_MISSING_FIELD", "message": "either phone or email is required"}
 
     # zipcode validation
-    res = zipcode_search.by_zipcode(zipcode)
-    if not res:
+    if not get_zipcode_index().is_valid(zipcode):
         return {"status": "REJECTED", "code": "4_INVALID_ZIP", "message": "Invalid Postal Code"}
 
     # check for TCPA Consent
@@ -87,11 +111,7 @@ def validate_adf_values(input_json):
 def check_validation(input_json):
     try:
         process_before_validating(input_json)
-        validate(
-            instance=input_json,
-            schema=schema,
-            format_checker=draft7_format_checker,
-        )
+        validate_adf_schema(input_json)
         response = validate_adf_values(input_json)
         if response['status'] == "REJECTED":
             return False, response['code'], response['message']
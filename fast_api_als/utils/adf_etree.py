@@ -0,0 +1,74 @@
+import logging
+import xmltodict
+import xml.etree.ElementTree as ElementTree
+from xml.parsers.expat import ExpatError
+
+logger = logging.getLogger(__name__)
+
+"""
+ElementTree based ADF parser.
+Builds the same structure xmltodict.parse() returns ('@' prefixed attributes, '#text' for text next to
+attributes or children, lists for repeated elements, whitespace stripped) straight from the C parser's
+tree, without xmltodict's per-event Python callbacks.
+Documents that use namespaces are handed to xmltodict: ElementTree rewrites namespaced names and
+drops xmlns declarations, which xmltodict keeps as '@xmlns' attributes.
+"""
+
+
+class NamespacedDocument(Exception):
+    pass
+
+
+def push_data(item, key, data):
+    if item is None:
+        item = {}
+    if key in item:
+        value = item[key]
+        if isinstance(value, list):
+            value.append(data)
+        else:
+            item[key] = [value, data]
+    else:
+        item[key] = data
+    return item
+
+
+def element_to_dict(element):
+    item = None
+    if element.attrib:
+        item = {}
+        for key, value in element.attrib.items():
+            if key[0] == '{':
+                raise NamespacedDocument(key)
+            item['@' + key] = value
+
+    data = [element.text] if element.text else []
+    for child in element:
+        if child.tag[0] == '{':
+            raise NamespacedDocument(child.tag)
+        item = push_data(item, child.tag, element_to_dict(child))
+        if child.tail:
+            data.append(child.tail)
+
+    data = ''.join(data).strip() or None
+    if item is not None:
+        if data:
+            push_data(item, '#text', data)
+        return item
+    return data
+
+
+def parse_adf_etree(adf_xml):
+    if (b'xmlns' if isinstance(adf_xml, bytes) else 'xmlns') in adf_xml:
+        return xmltodict.parse(adf_xml)
+    try:
+        root = ElementTree.fromstring(adf_xml)
+    except ElementTree.ParseError as e:
+        # keep the error contract of the xmltodict backend
+        raise ExpatError(str(e))
+    try:
+        if root.tag[0] == '{':
+            raise NamespacedDocument(root.tag)
+        return {root.tag: element_to_dict(root)}
+    except NamespacedDocument:
+        return xmltodict.parse(adf_xml)
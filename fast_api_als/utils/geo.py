@@ -0,0 +1,15 @@
+import math
+
+"""
+Great-circle distance shared by the dealer index and lead enrichment.
+Uses the same haversine/earth radius as dynamodbgeo's queryRadius, so in-memory distances match
+the DynamoDB path.
+"""
+
+EARTH_RADIUS_METERS = 6367000.0
+
+
+def haversine_meters(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * math.asin(min(1.0, math.sqrt(a))) * EARTH_RADIUS_METERS
@@ -0,0 +1,129 @@
+import os
+import sys
+import copy
+import json
+import time
+import queue
+import random
+import logging
+import contextvars
+from logging.handlers import QueueHandler, QueueListener
+
+from fast_api_als.utils.metrics import metrics_registry
+
+"""
+Non-blocking, structured logging.
+Request handlers only put records on an in-memory queue (QueueHandler), a QueueListener thread
+formats them as one JSON object per line and writes them out. Every record carries the request id
+and lead hash of the request that logged it, DEBUG records are sampled.
+The time spent in the request path per record is tracked as logging.enqueue on /metrics.
+"""
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', '0.01'))
+
+request_id_var = contextvars.ContextVar('request_id', default=None)
+lead_hash_var = contextvars.ContextVar('lead_hash', default=None)
+
+# attributes every LogRecord has, everything else was passed with extra=
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+log_listener = None
+# root handlers and level from before setup_logging(), put back by stop_logging()
+previous_root_config = None
+
+
+class ContextFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        record.lead_hash = getattr(record, 'lead_hash', None) or lead_hash_var.get()
+        record.stage = getattr(record, 'stage', None)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, debug_sample_rate: float = LOG_DEBUG_SAMPLE_RATE):
+        super().__init__()
+        self.debug_sample_rate = debug_sample_rate
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        return random.random() < self.debug_sample_rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            'timestamp': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and value is not None:
+                data[key] = value
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class TimedQueueHandler(QueueHandler):
+    def prepare(self, record):
+        # QueueHandler.prepare() folds the traceback into the message and drops exc_info,
+        # keep it as its own field instead
+        exception = record.exc_text
+        if record.exc_info:
+            exception = logging.Formatter().formatException(record.exc_info)
+        stack = record.stack_info
+        record = copy.copy(record)
+        record.exc_info, record.exc_text, record.stack_info = None, None, None
+        record = super().prepare(record)
+        record.exception = exception
+        record.stack = stack
+        return record
+
+    def emit(self, record):
+        start = time.perf_counter()
+        super().emit(record)
+        metrics_registry.observe('logging.enqueue', (time.perf_counter() - start) * 1000.0)
+
+
+def setup_logging(level: str = LOG_LEVEL):
+    global log_listener, previous_root_config
+    if log_listener is not None:
+        return
+    log_queue = queue.Queue(-1)
+    queue_handler = TimedQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter())
+    queue_handler.addFilter(ContextFilter())
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+
+    root = logging.getLogger()
+    previous_root_config = (root.handlers, root.level)
+    root.handlers = [queue_handler]
+    root.setLevel(level)
+    log_listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    log_listener.start()
+
+
+def stop_logging():
+    # flushes the records still queued, later records go to the handlers from before setup_logging()
+    global log_listener, previous_root_config
+    if log_listener is None:
+        return
+    root = logging.getLogger()
+    root.handlers, level = previous_root_config
+    root.setLevel(level)
+    previous_root_config = None
+    log_listener.stop()
+    log_listener = None
+
+
+def bind_log_context(request_id: str = None, lead_hash: str = None):
+    if request_id is not None:
+        request_id_var.set(request_id)
+    if lead_hash is not None:
+        lead_hash_var.set(lead_hash)
@@ -0,0 +1,155 @@
+import math
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+"""
+In-process latency metrics.
+Every stage of a request is timed with a StageTimer, the durations are pushed into
+per-stage histograms of metrics_registry and the percentiles are served on /metrics.
+"""
+
+HISTOGRAM_WINDOW = 2048
+
+
+class LatencyHistogram:
+    def __init__(self, window: int = HISTOGRAM_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value_ms: float):
+        with self.lock:
+            self.samples.append(value_ms)
+            self.count += 1
+            self.total += value_ms
+
+    def snapshot(self):
+        with self.lock:
+            samples = sorted(self.samples)
+            count = self.count
+            total = self.total
+        if not samples:
+            return {"count": count}
+        return {
+            "count": count,
+            "avg_ms": round(total / count, 3),
+            "p50_ms": round(percentile(samples, 50), 3),
+            "p95_ms": round(percentile(samples, 95), 3),
+            "p99_ms": round(percentile(samples, 99), 3),
+            "max_ms": round(samples[-1], 3)
+        }
+
+
+def percentile(sorted_samples, pct):
+    """
+            Nearest-rank percentile of an already sorted list.
+            Args:
+                sorted_samples: samples in ascending order
+                pct: percentile between 0 and 100
+            Returns:
+                sample value at the percentile
+    """
+    rank = max(math.ceil(pct / 100.0 * len(sorted_samples)) - 1, 0)
+    return sorted_samples[min(rank, len(sorted_samples) - 1)]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.histograms = {}
+        self.gauges = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def histogram(self, name: str) -> LatencyHistogram:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name, LatencyHistogram())
+        return histogram
+
+    def observe(self, name: str, value_ms: float):
+        self.histogram(name).observe(value_ms)
+
+    def increment(self, name: str, value: float = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def register_gauge(self, name: str, func):
+        # func is called lazily when /metrics is read
+        self.gauges[name] = func
+
+    def snapshot(self):
+        gauges = {}
+        for name, func in list(self.gauges.items()):
+            try:
+                gauges[name] = func()
+            except Exception as e:
+                logger.warning(f"Failed to read gauge {name}: {e}")
+        with self.lock:
+            counters = dict(self.counters)
+        return {
+            "latency": {name: histogram.snapshot() for name, histogram in list(self.histograms.items())},
+            "counters": counters,
+            "gauges": gauges
+        }
+
+
+class StageTimer:
+    """
+            Records how long each stage of one request takes.
+            Stages may be timed from worker threads, so records are appended under a lock.
+    """
+    def __init__(self, pipeline: str, registry: MetricsRegistry = None):
+        self.pipeline = pipeline
+        self.registry = registry or metrics_registry
+        self.start = time.perf_counter()
+        self.stages = []
+        self.context = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        stage_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - stage_start) * 1000.0)
+
+    def timed(self, name: str, func, *args, **kwargs):
+        with self.stage(name):
+            return func(*args, **kwargs)
+
+    async def timed_async(self, name: str, awaitable):
+        with self.stage(name):
+            return await awaitable
+
+    def record(self, name: str, duration_ms: float):
+        with self.lock:
+            self.stages.append((name, duration_ms))
+        self.registry.observe(f"{self.pipeline}.{name}", duration_ms)
+        logger.debug(f"{self.pipeline} stage {name} done", extra={
+            "stage": name,
+            "duration_ms": round(duration_ms, 3)
+        })
+
+    def finish(self, **context):
+        total_ms = (time.perf_counter() - self.start) * 1000.0
+        self.registry.observe(f"{self.pipeline}.total", total_ms)
+        with self.lock:
+            stages = {name: round(duration, 3) for name, duration in self.stages}
+        logger.info(f"{self.pipeline} timings", extra={
+            "timings": stages,
+            "total_ms": round(total_ms, 3),
+            **self.context,
+            **context
+        })
+        return total_ms
+
+
+metrics_registry = MetricsRegistry()
@@ -0,0 +1,132 @@
+import os
+import time
+import gzip
+import json
+import uuid
+import asyncio
+import logging
+from datetime import datetime
+from collections import defaultdict
+
+from fast_api_als.quicksight.s3_helper import s3_helper_client
+from fast_api_als.utils.boto3_utils import get_boto3_session
+from fast_api_als.utils.metrics import metrics_registry
+
+logger = logging.getLogger(__name__)
+
+"""
+Background upload of QuickSight records.
+Request handlers only add() the record, it is buffered per make/date and written as one gzip NDJSON
+object per partition (<make>/<yyyy-mm-dd>/<uuid>.ndjson.gz) every QUICKSIGHT_FLUSH_INTERVAL seconds
+or as soon as a partition holds QUICKSIGHT_MAX_RECORDS records.
+Without QUICKSIGHT_S3_BUCKET configured the records are still uploaded off the request path,
+one s3_helper_client.put_file() per record as before.
+Failed writes are retried with backoff, uploaded/retried/dropped counts are reported on /metrics.
+"""
+
+QUICKSIGHT_S3_BUCKET = os.getenv('QUICKSIGHT_S3_BUCKET')
+QUICKSIGHT_FLUSH_INTERVAL = 60
+QUICKSIGHT_MAX_RECORDS = 5000
+QUICKSIGHT_RETRY_ATTEMPTS = 5
+QUICKSIGHT_RETRY_BASE_DELAY = 0.5
+
+
+class QuickSightUploader:
+    def __init__(self, bucket: str = QUICKSIGHT_S3_BUCKET, flush_interval: float = QUICKSIGHT_FLUSH_INTERVAL,
+                 max_records: int = QUICKSIGHT_MAX_RECORDS):
+        self.bucket = bucket
+        self.flush_interval = flush_interval
+        self.max_records = max_records
+        self.buffers = defaultdict(list)
+        self.s3_client = None
+        self.flusher = None
+        self.uploads = set()
+
+    def start(self):
+        if self.bucket and self.s3_client is None:
+            self.s3_client = get_boto3_session().client('s3')
+        if self.flusher is None:
+            self.flusher = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        if self.flusher is not None:
+            self.flusher.cancel()
+            self.flusher = None
+        self.flush_all()
+        if self.uploads:
+            await asyncio.gather(*self.uploads, return_exceptions=True)
+
+    def add(self, item: dict, path: str):
+        if self.flusher is None:
+            self.start()
+        epoch_timestamp = item.get('epoch_timestamp') or time.time()
+        partition = (item.get('make', 'unknown'), datetime.utcfromtimestamp(epoch_timestamp).strftime('%Y-%m-%d'))
+        records = self.buffers[partition]
+        records.append((item, path))
+        if len(records) >= self.max_records:
+            self.flush(partition)
+
+    def buffered(self) -> int:
+        return sum(len(records) for records in self.buffers.values())
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush_all()
+
+    def flush_all(self):
+        for partition in list(self.buffers):
+            self.flush(partition)
+
+    def flush(self, partition):
+        records = self.buffers.pop(partition, None)
+        if not records:
+            return
+        loop = asyncio.get_running_loop()
+        upload = asyncio.ensure_future(loop.run_in_executor(None, self.upload, partition, records))
+        self.uploads.add(upload)
+        upload.add_done_callback(self.uploads.discard)
+
+    def upload(self, partition, records):
+        make, date = partition
+        pending = records
+        for attempt in range(QUICKSIGHT_RETRY_ATTEMPTS):
+            if attempt:
+                metrics_registry.increment("quicksight_uploader.retries")
+                time.sleep(QUICKSIGHT_RETRY_BASE_DELAY * (2 ** (attempt - 1)))
+            try:
+                pending = self.put_records(partition, pending)
+            except Exception as e:
+                logger.warning(f"Uploading {len(pending)} QuickSight records for {make}/{date} failed "
+                               f"(attempt {attempt + 1}): {e}")
+            if not pending:
+                metrics_registry.increment("quicksight_uploader.uploaded", len(records))
+                return
+        metrics_registry.increment("quicksight_uploader.uploaded", len(records) - len(pending))
+        metrics_registry.increment("quicksight_uploader.dropped", len(pending))
+        logger.error(f"Dropped {len(pending)} QuickSight records for {make}/{date} after "
+                     f"{QUICKSIGHT_RETRY_ATTEMPTS} attempts")
+
+    def put_records(self, partition, records) -> list:
+        """
+                Returns:
+                    the records that were not written
+        """
+        make, date = partition
+        if self.s3_client is None:
+            for i, (item, path) in enumerate(records):
+                try:
+                    s3_helper_client.put_file(item, path)
+                except Exception as e:
+                    logger.warning(f"Uploading QuickSight record {path} failed: {e}")
+                    return records[i:]
+            return []
+        body = gzip.compress('\n'.join(json.dumps(item, default=str) for item, _ in records).encode('utf-8'))
+        key = f"{make}/{date}/{uuid.uuid4()}.ndjson.gz"
+        self.s3_client.put_object(Bucket=self.bucket, Key=key, Body=body,
+                                  ContentType='application/x-ndjson', ContentEncoding='gzip')
+        return []
+
+
+quicksight_uploader = QuickSightUploader()
+metrics_registry.register_gauge("quicksight_buffered_records", quicksight_uploader.buffered)
@@ -0,0 +1,29 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+            Coalesces concurrent calls with the same key: the first caller runs the coroutine,
+            callers arriving while it is in flight await its result instead of running it again.
+    """
+    def __init__(self):
+        self.calls = {}
+
+    async def do(self, key, coroutine_factory):
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coroutine_factory())
+            self.calls[key] = task
+            task.add_done_callback(lambda done: self.forget(key, done))
+        # shield so that one cancelled caller does not cancel the call for the others
+        return await asyncio.shield(task)
+
+    def forget(self, key, task):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+
+    def in_flight(self) -> int:
+        return len(self.calls)
@@ -0,0 +1,242 @@
+import os
+import json
+import asyncio
+import logging
+import re
+import uuid
+import threading
+
+from fast_api_als.utils.boto3_utils import get_boto3_session
+from fast_api_als.utils.metrics import metrics_registry
+from fast_api_als.utils.sqs_utils import sqs_helper_session
+
+logger = logging.getLogger(__name__)
+
+"""
+Buffered, asynchronous publishing of lead persistence messages.
+publish() only puts the message on an in-process queue, worker tasks drain it in batches of up to
+SQS_BATCH_SIZE messages (SendMessageBatch limit) or whatever arrived within SQS_FLUSH_INTERVAL_MS.
+When SQS_MAX_QUEUED messages are waiting, publish() blocks until there is room again.
+stop() flushes everything still queued.
+
+Messages are sent with SendMessageBatch to SQS_QUEUE_URL as JSON. Failed entries are retried with
+backoff, what still fails goes to SQS_DEAD_LETTER_QUEUE_URL, or when that is not configured or fails
+too, to a per-process spool file in SQS_SPOOL_DIR that is published again on the next start.
+Without SQS_QUEUE_URL the messages go through sqs_helper_session.send_message() one by one.
+"""
+
+SQS_QUEUE_URL = os.getenv('SQS_QUEUE_URL')
+SQS_DEAD_LETTER_QUEUE_URL = os.getenv('SQS_DEAD_LETTER_QUEUE_URL')
+# absolute, host-local directory, every worker process spools to its own file in it
+SQS_SPOOL_DIR = os.getenv('SQS_SPOOL_DIR')
+SQS_BATCH_SIZE = 10
+SQS_FLUSH_INTERVAL_MS = 20
+SQS_MAX_QUEUED = 10000
+SQS_PUBLISHER_WORKERS = 4
+SQS_RETRY_ATTEMPTS = 5
+SQS_RETRY_BASE_DELAY = 0.1
+# sqs_publisher_spool.<pid>.ndjson, while being replayed ...ndjson.replay.<pid of the replaying worker>.<id>
+SPOOL_FILE_PATTERN = re.compile(r"sqs_publisher_spool\.(?P<pid>\d+)\.ndjson(\.replay\.(?P<replay_pid>\d+)\.\w+)?")
+
+
+def process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class BufferedSQSPublisher:
+    def __init__(self, sqs_helper, queue_url: str = SQS_QUEUE_URL,
+                 dead_letter_queue_url: str = SQS_DEAD_LETTER_QUEUE_URL, spool_dir: str = SQS_SPOOL_DIR,
+                 batch_size: int = SQS_BATCH_SIZE, flush_interval_ms: float = SQS_FLUSH_INTERVAL_MS,
+                 max_queued: int = SQS_MAX_QUEUED, workers: int = SQS_PUBLISHER_WORKERS):
+        self.sqs_helper = sqs_helper
+        self.queue_url = queue_url
+        self.dead_letter_queue_url = dead_letter_queue_url
+        self.spool_dir = spool_dir
+        self.spool_lock = threading.Lock()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_queued = max_queued
+        self.worker_count = workers
+        self.sqs_client = None
+        self.queue = None
+        self.workers = []
+        self.in_flight = 0
+
+    def start(self):
+        if not self.spool_dir or not os.path.isabs(self.spool_dir):
+            raise ValueError(f"SQS_SPOOL_DIR must be an absolute directory, got {self.spool_dir!r}")
+        os.makedirs(self.spool_dir, exist_ok=True)
+        if self.queue_url and self.sqs_client is None:
+            self.sqs_client = get_boto3_session().client('sqs')
+        if self.queue is None:
+            self.queue = asyncio.Queue(maxsize=self.max_queued)
+        if not self.workers:
+            self.workers = [asyncio.ensure_future(self.run()) for _ in range(self.worker_count)]
+            self.workers.append(asyncio.ensure_future(self.replay_spool()))
+
+    async def stop(self):
+        if self.queue is None:
+            return
+        await self.queue.join()
+        for worker in self.workers:
+            worker.cancel()
+        self.workers = []
+
+    async def publish(self, message: dict):
+        if not self.workers:
+            self.start()
+        await self.queue.put(message)
+
+    def depth(self) -> int:
+        queued = self.queue.qsize() if self.queue is not None else 0
+        return queued + self.in_flight
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self.in_flight += len(batch)
+            try:
+                await self.deliver(batch)
+            finally:
+                self.in_flight -= len(batch)
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def deliver(self, messages: list):
+        loop = asyncio.get_running_loop()
+        pending, rejected = messages, []
+        for attempt in range(SQS_RETRY_ATTEMPTS):
+            if attempt:
+                metrics_registry.increment("sqs_publisher.retries", len(pending))
+                await asyncio.sleep(SQS_RETRY_BASE_DELAY * (2 ** (attempt - 1)))
+            try:
+                retryable, failed = await loop.run_in_executor(None, self.send_batch, pending)
+            except Exception as e:
+                logger.warning(f"Publishing {len(pending)} lead messages to SQS failed (attempt {attempt + 1}): {e}")
+                retryable, failed = pending, []
+            rejected.extend(failed)
+            metrics_registry.increment("sqs_publisher.sent", len(pending) - len(retryable) - len(failed))
+            pending = retryable
+            if not pending:
+                break
+        undelivered = rejected + pending
+        if undelivered:
+            await loop.run_in_executor(None, self.dead_letter, undelivered)
+
+    def send_batch(self, messages: list):
+        """
+                Sends up to SQS_BATCH_SIZE messages.
+                Returns:
+                    (messages worth retrying, messages SQS rejected as invalid)
+        """
+        if self.sqs_client is None:
+            failed = []
+            for message in messages:
+                try:
+                    self.sqs_helper.send_message(message)
+                except Exception as e:
+                    logger.warning(f"Publishing a lead message to SQS failed: {e}")
+                    failed.append(message)
+            return failed, []
+        return self.send_message_batch(self.queue_url, messages)
+
+    def send_message_batch(self, queue_url: str, messages: list):
+        entries = [{'Id': str(i), 'MessageBody': json.dumps(message, default=str)}
+                   for i, message in enumerate(messages)]
+        res = self.sqs_client.send_message_batch(QueueUrl=queue_url, Entries=entries)
+        retryable, rejected = [], []
+        for failure in res.get('Failed', []):
+            message = messages[int(failure['Id'])]
+            logger.warning(f"SQS rejected a lead message: {failure.get('Code')} {failure.get('Message')}")
+            # sender faults (e.g. an oversized message) fail the same way on every retry
+            (rejected if failure.get('SenderFault') else retryable).append(message)
+        return retryable, rejected
+
+    def dead_letter(self, messages: list):
+        if self.sqs_client is not None and self.dead_letter_queue_url:
+            try:
+                retryable, rejected = self.send_message_batch(self.dead_letter_queue_url, messages)
+                metrics_registry.increment("sqs_publisher.dead_lettered",
+                                           len(messages) - len(retryable) - len(rejected))
+                messages = retryable + rejected
+            except Exception as e:
+                logger.error(f"Publishing {len(messages)} lead messages to the dead letter queue failed: {e}")
+            if not messages:
+                return
+        self.spool(messages)
+
+    def spool(self, messages: list):
+        spool_path = os.path.join(self.spool_dir, f"sqs_publisher_spool.{os.getpid()}.ndjson")
+        try:
+            with self.spool_lock, open(spool_path, 'a') as spool:
+                for message in messages:
+                    spool.write(json.dumps(message, default=str) + '\n')
+            metrics_registry.increment("sqs_publisher.spooled", len(messages))
+            logger.error(f"Spooled {len(messages)} undelivered lead messages to {spool_path}")
+        except OSError as e:
+            metrics_registry.increment("sqs_publisher.dropped", len(messages))
+            logger.error(f"Dropped {len(messages)} undelivered lead messages, spooling failed: {e}")
+
+    def take_spool(self) -> list:
+        """
+                Claims the spool files of this and of exited worker processes, including replays they did
+                not finish. A file is claimed by renaming it to a name unique to this process, so two workers
+                starting at once never read the same file.
+        """
+        messages = []
+        for name in sorted(os.listdir(self.spool_dir)):
+            match = SPOOL_FILE_PATTERN.fullmatch(name)
+            if match is None:
+                continue
+            owner = int(match.group('replay_pid') or match.group('pid'))
+            if owner != os.getpid() and process_alive(owner):
+                continue
+            path = os.path.join(self.spool_dir, name)
+            claimed_path = f"{path.split('.replay.')[0]}.replay.{os.getpid()}.{uuid.uuid4().hex}"
+            try:
+                with self.spool_lock:
+                    os.rename(path, claimed_path)
+            except FileNotFoundError:
+                # claimed by another worker
+                continue
+            with open(claimed_path) as spool:
+                for line in spool:
+                    try:
+                        messages.append(json.loads(line))
+                    except ValueError:
+                        metrics_registry.increment("sqs_publisher.dropped")
+                        logger.error(f"Dropped an unreadable spooled lead message: {line[:200]!r}")
+            os.remove(claimed_path)
+        return messages
+
+    async def replay_spool(self):
+        # messages spooled by an earlier run are published again
+        try:
+            messages = await asyncio.get_running_loop().run_in_executor(None, self.take_spool)
+        except OSError as e:
+            logger.error(f"Reading the SQS spool in {self.spool_dir} failed: {e}")
+            return
+        if messages:
+            logger.info(f"Republishing {len(messages)} spooled lead messages")
+        for message in messages:
+            await self.queue.put(message)
+
+
+sqs_publisher = BufferedSQSPublisher(sqs_helper_session)
+metrics_registry.register_gauge("sqs_publisher_queue_depth", sqs_publisher.depth)
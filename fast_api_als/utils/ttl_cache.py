@@ -0,0 +1,81 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+            Bounded, thread-safe LRU cache whose entries expire after a TTL.
+            Args:
+                maxsize: maximum number of entries, least recently used ones are evicted first
+                ttl: default lifetime of an entry in seconds
+                negative_ttl: lifetime used by set_negative(), defaults to ttl
+    """
+    def __init__(self, maxsize: int, ttl: float, negative_ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        """
+                Returns:
+                    (True, value) on a hit, (False, None) on a miss or an expired entry
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self.entries[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value, ttl: float = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self.lock:
+            self.entries[key] = (expires_at, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def set_negative(self, key, value):
+        self.set(key, value, self.negative_ttl)
+
+    def get_or_load(self, key, loader, is_negative=None):
+        """
+                Returns the cached value of key, calling loader() and caching its result on a miss.
+                Results for which is_negative(result) is true are kept for negative_ttl only.
+        """
+        hit, value = self.lookup(key)
+        if hit:
+            return value
+        value = loader()
+        if is_negative is not None and is_negative(value):
+            self.set_negative(key, value)
+        else:
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses
+            }
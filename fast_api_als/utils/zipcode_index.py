@@ -0,0 +1,93 @@
+import logging
+import math
+import threading
+from array import array
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+"""
+In-memory index of US zipcodes, loaded once from the uszipcode database.
+Zipcodes are kept as sorted ints next to their lat/lon in plain arrays (20 bytes per zipcode,
+under 1 MB for the ~42k zipcodes), so lookups are a binary search with no SQLite access
+and the index can be shared by every thread.
+"""
+
+
+class ZipcodeIndex:
+    def __init__(self, rows):
+        # rows: iterable of (zipcode, lat, lon)
+        parsed = []
+        for zipcode, lat, lon in rows:
+            key = zipcode_key(zipcode)
+            if key is None:
+                continue
+            parsed.append((key,
+                           math.nan if lat is None else float(lat),
+                           math.nan if lon is None else float(lon)))
+        parsed.sort()
+        self.zipcodes = array('i', (row[0] for row in parsed))
+        self.lats = array('d', (row[1] for row in parsed))
+        self.lons = array('d', (row[2] for row in parsed))
+
+    @classmethod
+    def from_search_engine(cls):
+        from uszipcode import SearchEngine
+        search_engine = SearchEngine()
+        try:
+            zip_klass = search_engine.zip_klass
+            rows = search_engine.ses.query(zip_klass.zipcode, zip_klass.lat, zip_klass.lng).all()
+        finally:
+            search_engine.close()
+        index = cls(rows)
+        logger.info(f"Loaded {len(index)} zipcodes ({index.memory_bytes()} bytes)")
+        return index
+
+    def __len__(self):
+        return len(self.zipcodes)
+
+    def position(self, zipcode):
+        key = zipcode_key(zipcode)
+        if key is None:
+            return -1
+        i = bisect_left(self.zipcodes, key)
+        if i < len(self.zipcodes) and self.zipcodes[i] == key:
+            return i
+        return -1
+
+    def is_valid(self, zipcode) -> bool:
+        return self.position(zipcode) >= 0
+
+    def coordinates(self, zipcode):
+        """
+                Returns:
+                    (lat, lon) of the zipcode, None if it is unknown or has no coordinates
+        """
+        i = self.position(zipcode)
+        if i < 0 or math.isnan(self.lats[i]) or math.isnan(self.lons[i]):
+            return None
+        return self.lats[i], self.lons[i]
+
+    def memory_bytes(self) -> int:
+        return sum(a.itemsize * len(a) for a in (self.zipcodes, self.lats, self.lons))
+
+
+def zipcode_key(zipcode):
+    # same zero padding SearchEngine.by_zipcode applies
+    zipcode = str(zipcode).zfill(5)
+    if len(zipcode) != 5 or not zipcode.isdigit():
+        return None
+    return int(zipcode)
+
+
+zipcode_index = None
+zipcode_index_lock = threading.Lock()
+
+
+def get_zipcode_index() -> ZipcodeIndex:
+    global zipcode_index
+    if zipcode_index is None:
+        with zipcode_index_lock:
+            if zipcode_index is None:
+                zipcode_index = ZipcodeIndex.from_search_engine()
+    return zipcode_index
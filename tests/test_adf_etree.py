@@ -0,0 +1,79 @@
+import pytest
+import xmltodict
+from xml.parsers.expat import ExpatError
+
+from fast_api_als.utils.adf_etree import parse_adf_etree
+
+ADF_LEAD = """<?xml version="1.0" encoding="UTF-8"?>
+<?adf version="1.0"?>
+<adf>
+  <prospect status="new">
+    <id sequence="1" source="3PL">abc-123</id>
+    <id sequence="2" source="TCPA_Consent">yes</id>
+    <requestdate>2022-06-01T10:00:00-05:00</requestdate>
+    <vehicle interest="buy" status="new">
+      <year>2022</year>
+      <make>Honda</make>
+      <model>Civic</model>
+      <price type="quote" currency="USD">21000</price>
+      <comments><![CDATA[Looking for <blue> & cheap]]></comments>
+    </vehicle>
+    <customer>
+      <contact>
+        <!-- contact details -->
+        <name part="first" type="individual">John</name>
+        <name part="last" type="individual">Doe</name>
+        <email preferredcontact="1">john.doe@example.com</email>
+        <phone type="voice">555-555-0100</phone>
+        <address type="home">
+          <street line="1">1 Main St &amp; 2nd</street>
+          <postalcode>02139</postalcode>
+        </address>
+      </contact>
+      <comments/>
+    </customer>
+    <vendor>
+      <id source="dealer">D123</id>
+      <vendorname>Best Motors</vendorname>
+      <contact primarycontact="1">mixed <name part="full">Jane</name> text</contact>
+    </vendor>
+    <provider>
+      <name part="full">Lead Co</name>
+      <service>LeadCo</service>
+    </provider>
+  </prospect>
+</adf>
+"""
+
+NAMESPACED_ADF_LEAD = """<?xml version="1.0"?>
+<adf xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="adf.xsd">
+  <prospect><requestdate>2022-06-01T10:00:00Z</requestdate></prospect>
+</adf>
+"""
+
+UNUSED_NAMESPACE_ADF_LEAD = """<adf xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"><prospect><id>1</id></prospect></adf>"""
+
+DEFAULT_NAMESPACE_ADF_LEAD = """<adf xmlns="http://example.com/adf"><prospect><id>1</id></prospect></adf>"""
+
+
+@pytest.mark.parametrize("adf_xml", [
+    ADF_LEAD,
+    ADF_LEAD.encode('utf-8'),
+    NAMESPACED_ADF_LEAD,
+    UNUSED_NAMESPACE_ADF_LEAD,
+    DEFAULT_NAMESPACE_ADF_LEAD,
+    "<adf><prospect/></adf>",
+    "<adf>  </adf>",
+])
+def test_same_result_as_xmltodict(adf_xml):
+    assert parse_adf_etree(adf_xml) == xmltodict.parse(adf_xml)
+
+
+def test_keeps_namespace_declarations():
+    for adf_xml in (NAMESPACED_ADF_LEAD, UNUSED_NAMESPACE_ADF_LEAD):
+        assert parse_adf_etree(adf_xml)['adf']['@xmlns:xsi'] == "http://www.w3.org/2001/XMLSchema-instance"
+
+
+def test_invalid_xml_raises_expat_error():
+    with pytest.raises(ExpatError):
+        parse_adf_etree("<adf><prospect></adf>")